@@ -14,6 +14,7 @@ from django.utils.safestring import mark_safe
 from reversion.admin import VersionAdmin
 from smtplib import SMTPException
 
+from . import hbi
 from .models import (
     GastroSignup,
     NoticeSetting,
@@ -110,6 +111,11 @@ class SectionAccidentsAdmin(admin.ModelAdmin):
 
     section_link.short_description = _('section')
 
+    def save_model(self, request, obj, form, change):
+        # Edited datasets are replaced when they are imported again
+        obj.row_hash = None
+        super().save_model(request, obj, form, change)
+
 
 class SectionDetailsAdmin(admin.ModelAdmin):
     inlines = (PhotoInline,)
@@ -128,6 +134,16 @@ class SectionDetailsAdmin(admin.ModelAdmin):
 
     section_link.short_description = _('section')
 
+    def save_model(self, request, obj, form, change):
+        # Edited datasets are replaced when they are imported again
+        obj.row_hash = None
+        super().save_model(request, obj, form, change)
+        hbi.update_scores(Section.objects.filter(pk=obj.section_id))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        hbi.update_scores(Section.objects.filter(pk=obj.section_id))
+
 
 class SectionDetailsInline(admin.TabularInline):
     model = SectionDetails
@@ -151,6 +167,22 @@ class SectionAdmin(FMBGeoAdmin):
     def has_add_permission(self, request):
         return False
 
+    def save_model(self, request, obj, form, change):
+        # Edited sections are replaced when they are imported again
+        if form.has_changed():
+            obj.row_hash = None
+        super().save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        for inline_form in formset.forms:
+            if inline_form.has_changed():
+                inline_form.instance.row_hash = None
+        super().save_formset(request, form, formset, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        hbi.update_scores(Section.objects.filter(pk=form.instance.pk))
+
 
 class ProfileAdmin(admin.ModelAdmin):
     ordering = ('-created_date',)
@@ -1,12 +1,34 @@
 from django.apps import AppConfig
 from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from djoser.signals import user_activated
-from .signals import sign_up_newsletter_on_activation
+from .signals import (
+    invalidate_projects,
+    sign_up_newsletter_on_activation,
+    update_like_count,
+)
 
 
 class FixmyappConfig(AppConfig):
     name = 'fixmyapp'
 
     def ready(self):
+        from . import tiles
+
+        tiles.register(tiles.SECTIONS)
+        tiles.register(tiles.PROJECTS)
+
+        Like = self.get_model('Like')
+        Photo = self.get_model('Photo')
+        Project = self.get_model('Project')
+        Question = self.get_model('Question')
+        for model in (Project, Photo, Question, Like):
+            post_save.connect(invalidate_projects, sender=model)
+            post_delete.connect(invalidate_projects, sender=model)
+        m2m_changed.connect(invalidate_projects, sender=Project.faq.through)
+
+        post_save.connect(update_like_count, sender=Like)
+        post_delete.connect(update_like_count, sender=Like)
+
         if settings.TOGGLE_NEWSLETTER:
             user_activated.connect(sign_up_newsletter_on_activation)
@@ -0,0 +1,84 @@
+"""Caching of data derived from datasets that change infrequently
+
+Cache keys of derived data contain the current version of their dataset.
+Bumping the version, e.g. from model signals, makes all entries derived from
+the previous version unreachable at once. They are evicted when they expire.
+
+Versions are stored in the database rather than the cache. The default cache
+is local to each process, while datasets are also changed by other web
+workers and by management commands. Reading a version takes one query. A
+version bumped inside a transaction becomes visible when it commits, along
+with the changed data.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def get_version(name):
+    """Return the current version of a dataset"""
+    from .models import CacheVersion
+
+    version = CacheVersion.objects.filter(name=name).values_list('version', flat=True)
+    return version.first() or 0
+
+
+def bump_version(name):
+    """Discard all cached data derived from a dataset"""
+    from .models import CacheVersion
+
+    table = connection.ops.quote_name(CacheVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (name, version) VALUES (%s, 1) '
+            f'ON CONFLICT (name) DO UPDATE SET version = {table}.version + 1',
+            [name],
+        )
+
+
+class VersionedCacheMixin:
+    """Cache the data of list responses until their dataset's version changes
+
+    Responses carry an `ETag` computed from their data and a `Last-Modified`
+    header returned by `get_last_modified`, so that clients can revalidate
+    them using conditional requests.
+    """
+
+    # Name of the dataset whose version is part of the cache keys
+    cache_version = None
+
+    # Seconds that responses are kept in the cache
+    cache_timeout = 60 * 60 * 24
+
+    def get_last_modified(self):
+        """Return the time the listed data was last modified, or `None`"""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        # The URL contains the host, which is part of hyperlinks in the data
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f'responses:{self.cache_version}:{get_version(self.cache_version)}:{url}'
+
+        cached = cache.get(key)
+        if cached is None:
+            data = super().list(request, *args, **kwargs).data
+            content = json.dumps(data, cls=DjangoJSONEncoder)
+            etag = quote_etag(hashlib.md5(content.encode()).hexdigest())
+            cached = (data, etag, self.get_last_modified())
+            cache.set(key, cached, self.cache_timeout)
+
+        data, etag, last_modified = cached
+        timestamp = last_modified.timestamp() if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = Response(data)
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
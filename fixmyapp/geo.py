@@ -0,0 +1,80 @@
+"""Helpers for serving geometries to web maps"""
+import math
+
+from django.contrib.gis.db.models.functions import GeoFunc, SnapToGrid
+from django.contrib.gis.geos import Polygon
+from django.db.models import Value
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+# Zoom levels supported by web map tiles
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+# Width and height of a map tile in pixels
+TILE_SIZE = 256
+
+
+class SimplifyPreserveTopology(GeoFunc):
+    function = 'ST_SimplifyPreserveTopology'
+
+
+def parse_bbox(value):
+    """Parse a `min_lon,min_lat,max_lon,max_lat` query parameter
+
+    Raises:
+        ValidationError: If the value is not a valid bounding box
+
+    Returns:
+        Polygon: The bounding box in WGS 84
+    """
+    try:
+        bbox = tuple(float(c) for c in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        raise ValidationError({'bbox': _('Expected min_lon,min_lat,max_lon,max_lat.')})
+    polygon = Polygon.from_bbox(bbox)
+    polygon.srid = 4326
+    return polygon
+
+
+def parse_zoom(value):
+    """Parse a zoom level query parameter
+
+    Raises:
+        ValidationError: If the value is not an integer in the supported range
+    """
+    try:
+        zoom = int(value)
+    except ValueError:
+        zoom = None
+    if zoom is None or not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise ValidationError(
+            {
+                'zoom': _('Expected an integer between {} and {}.').format(
+                    MIN_ZOOM, MAX_ZOOM
+                )
+            }
+        )
+    return zoom
+
+
+def pixel_size(zoom):
+    """Approximate size of a pixel in degrees at the given zoom level"""
+    return 360 / (TILE_SIZE * 2**zoom)
+
+
+def simplified(expression, zoom):
+    """Simplify a WGS 84 geometry expression for display at a zoom level
+
+    Vertices closer than a pixel are removed and the remaining coordinates are
+    snapped to the coarsest decimal grid that is still finer than a pixel,
+    which keeps them short when serialized.
+
+    Returns:
+        A geometry expression that can be used in `annotate`
+    """
+    tolerance = pixel_size(zoom)
+    grid_size = 10 ** -math.ceil(-math.log10(tolerance))
+    return SnapToGrid(SimplifyPreserveTopology(expression, Value(tolerance)), grid_size)
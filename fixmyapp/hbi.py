@@ -0,0 +1,271 @@
+"""Batch computation of the Happy Bike Index (HBI)
+
+The methods on `SectionDetails` compute the HBI for a single dataset using
+decimal arithmetic. The functions in this module compute the same indices for
+many datasets at once by loading their input columns into NumPy arrays, which
+is much faster when exporting or serializing large numbers of sections.
+"""
+import numpy
+from django.db.models import QuerySet
+
+from . import tiles
+from .models import Section, SectionDetails
+
+# Model fields that are read to compute the HBI
+FIELDS = (
+    'speed_limit',
+    'daily_traffic',
+    'length',
+    'crossings',
+    'rva1',
+    'rva2',
+    'rva3',
+    'rva4',
+    'rva5',
+    'rva6',
+    'rva7',
+    'rva8',
+    'rva9',
+    'rva10',
+    'rva11',
+    'rva12',
+    'rva13',
+)
+
+# Names of all values returned by `compute`
+INDICES = (
+    'advisory_bike_lane_ratio',
+    'bike_lane_ratio',
+    'bike_path_ratio',
+    'cycling_infrastructure_ratio',
+    'cycling_infrastructure_safety',
+    'happy_bike_index',
+    'protected_bike_lane_ratio',
+    'road_type',
+    'safety_index',
+    'shared_use_path_ratio',
+    'velocity_index',
+)
+
+# Indices that are stored on `Section` as averages of their details' values
+SECTION_INDICES = ('happy_bike_index', 'safety_index', 'velocity_index')
+
+# Prefix of the model fields storing HBI values
+SCORE_FIELD_PREFIX = 'hbi_'
+
+# Weights of the rva1 - rva13 columns, see `SectionDetails.velocity_index`
+# and `SectionDetails.cycling_infrastructure_safety`
+# fmt: off
+VELOCITY_WEIGHTS = numpy.array([0, 0, 2, 1, 0, 0, 2, 3, 3, 3, 2, 3, 2], dtype=float)
+SAFETY_WEIGHTS = numpy.array([0, 0, 3, 3, 3, 3, 2, 3, 3, 3, 1, 1, 1], dtype=float)
+
+# Columns of the rva1 - rva13 columns that make up an infrastructure category
+CYCLING_INFRASTRUCTURE = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+BIKE_PATH = [2, 3, 9]
+SHARED_USE_PATH = [4, 5]
+BIKE_LANE = [6]
+PROTECTED_BIKE_LANE = [7, 8]
+ADVISORY_BIKE_LANE = [10, 11, 12]
+# fmt: on
+
+
+def load(details):
+    """Load the input columns of section details into arrays.
+
+    Parameters:
+        details: A `SectionDetails` queryset, which is evaluated using a single
+            `values_list` query, or an iterable of `SectionDetails` instances
+
+    Returns:
+        dict: Maps `pk`, `section_id` and the names in `FIELDS` to arrays with
+            one entry per dataset
+    """
+    columns = ('pk', 'section_id') + FIELDS
+    if isinstance(details, QuerySet):
+        rows = list(details.order_by().values_list(*columns))
+    else:
+        rows = [tuple(getattr(d, c) for c in columns) for d in details]
+
+    data = numpy.array(rows, dtype=float).reshape(len(rows), len(columns))
+    rv = {name: data[:, i] for i, name in enumerate(columns)}
+    rv['pk'] = rv['pk'].astype(int)
+    rv['section_id'] = rv['section_id'].astype(int)
+    rv['rva'] = data[:, len(columns) - 13 :]
+    return rv
+
+
+def _divide(dividend, divisor):
+    """Element-wise division that yields 0 where the divisor is 0"""
+    return numpy.divide(
+        dividend, divisor, out=numpy.zeros_like(dividend), where=divisor != 0
+    )
+
+
+def road_type(speed_limit, daily_traffic):
+    """Categorize traffic intensity, see `SectionDetails.road_type`"""
+    bins = numpy.searchsorted(
+        SectionDetails.ROAD_TYPE_SPEED_LIMITS, speed_limit, side='left'
+    )
+    thresholds = numpy.array(SectionDetails.ROAD_TYPE_THRESHOLDS, dtype=float)[bins]
+    l0, l1, l2 = thresholds[:, 0], thresholds[:, 1], thresholds[:, 2]
+    return numpy.select(
+        [daily_traffic <= l0, daily_traffic <= l1, daily_traffic <= l2],
+        [
+            daily_traffic / l0,
+            1 + (daily_traffic - l0) / (l1 - l0),
+            2 + (daily_traffic - l1) / (l2 - l1),
+        ],
+        default=3,
+    )
+
+
+def compute(columns):
+    """Compute all HBI indices and ratios for the columns returned by `load`
+
+    Returns:
+        dict: Maps each name in `INDICES` to an array of values
+    """
+    rva = columns['rva']
+    length_without_crossings = (
+        columns['length'] - SectionDetails.AVG_WIDTH_CROSSINGS * columns['crossings']
+    )
+    ci_sum = rva[:, CYCLING_INFRASTRUCTURE].sum(axis=1)
+    ci_ratio = _divide(ci_sum, length_without_crossings)
+    below_ci_ratio_min = ci_ratio < SectionDetails.CI_RATIO_MIN
+
+    velocity_sum = rva @ VELOCITY_WEIGHTS
+    ci_factor = numpy.where(
+        ci_sum > 0, _divide(velocity_sum, ci_sum * 3), velocity_sum / 3
+    )
+    velocity_index = numpy.where(
+        below_ci_ratio_min, ci_ratio * ci_factor + (1 - ci_ratio), ci_factor
+    )
+
+    ci_safety = numpy.where(
+        below_ci_ratio_min, 0.0, _divide(rva @ SAFETY_WEIGHTS, ci_sum)
+    )
+    road_types = road_type(columns['speed_limit'], columns['daily_traffic'])
+    safety_index = 2.25 * numpy.where(
+        ci_safety <= road_types,
+        3 + ci_safety - road_types,
+        3 + (ci_safety - road_types) / 3,
+    )
+
+    def category_ratio(category):
+        return numpy.where(
+            ci_ratio < SectionDetails.CI_CATEGORY_RATIO_MIN,
+            0.0,
+            _divide(rva[:, category].sum(axis=1), length_without_crossings),
+        )
+
+    return {
+        'advisory_bike_lane_ratio': category_ratio(ADVISORY_BIKE_LANE),
+        'bike_lane_ratio': category_ratio(BIKE_LANE),
+        'bike_path_ratio': category_ratio(BIKE_PATH),
+        'cycling_infrastructure_ratio': ci_ratio,
+        'cycling_infrastructure_safety': ci_safety,
+        'happy_bike_index': velocity_index + safety_index,
+        'protected_bike_lane_ratio': category_ratio(PROTECTED_BIKE_LANE),
+        'road_type': road_types,
+        'safety_index': safety_index,
+        'shared_use_path_ratio': category_ratio(SHARED_USE_PATH),
+        'velocity_index': velocity_index,
+    }
+
+
+def section_averages(columns, results):
+    """Average indices of all details of each section
+
+    Returns:
+        dict: Maps section ids to dicts with the indices in `SECTION_INDICES`
+    """
+    section_ids, inverse, counts = numpy.unique(
+        columns['section_id'], return_inverse=True, return_counts=True
+    )
+    averages = {
+        name: numpy.bincount(inverse, weights=results[name], minlength=len(counts))
+        / counts
+        for name in SECTION_INDICES
+    }
+    return {
+        int(section_id): {name: float(values[i]) for name, values in averages.items()}
+        for i, section_id in enumerate(section_ids)
+    }
+
+
+def _by_pk(columns, results):
+    return {
+        int(pk): {name: float(results[name][i]) for name in INDICES}
+        for i, pk in enumerate(columns['pk'])
+    }
+
+
+def compute_for_details(details):
+    """Compute HBI indices for section details
+
+    Parameters:
+        details: A `SectionDetails` queryset or an iterable of instances
+
+    Returns:
+        dict: Maps the primary key of each dataset to a dict of its indices
+    """
+    columns = load(details)
+    return _by_pk(columns, compute(columns))
+
+
+def compute_for_sections(details):
+    """Compute HBI indices for section details and their sections
+
+    Returns:
+        tuple: A dict of indices by section details primary key as returned by
+            `compute_for_details` and a dict of averages by section id as
+            returned by `section_averages`
+    """
+    columns = load(details)
+    results = compute(columns)
+    return _by_pk(columns, results), section_averages(columns, results)
+
+
+def update_scores(sections=None, batch_size=1000):
+    """Recompute and store the HBI of sections and their details
+
+    Sections without any details are assigned zero values in accordance with
+    `Section.velocity_index` and `Section.safety_index`.
+
+    Parameters:
+        sections: A `Section` queryset, defaults to all sections
+        batch_size (int): Number of rows written per query
+    """
+    if sections is None:
+        sections = Section.objects.all()
+    section_model = sections.model
+    details_model = section_model._meta.get_field('details').related_model
+
+    columns = load(details_model.objects.filter(section__in=sections))
+    results = compute(columns)
+
+    details_model.objects.bulk_update(
+        [
+            details_model(
+                pk=pk, **{SCORE_FIELD_PREFIX + k: v for k, v in values.items()}
+            )
+            for pk, values in _by_pk(columns, results).items()
+        ],
+        [SCORE_FIELD_PREFIX + name for name in INDICES],
+        batch_size=batch_size,
+    )
+
+    section_model.objects.bulk_update(
+        [
+            section_model(
+                pk=pk, **{SCORE_FIELD_PREFIX + k: v for k, v in values.items()}
+            )
+            for pk, values in section_averages(columns, results).items()
+        ],
+        [SCORE_FIELD_PREFIX + name for name in SECTION_INDICES],
+        batch_size=batch_size,
+    )
+    sections.filter(details__isnull=True).update(
+        **{SCORE_FIELD_PREFIX + name: 0 for name in SECTION_INDICES}
+    )
+    tiles.invalidate('sections')
@@ -1,12 +1,30 @@
 from django.contrib.gis.gdal import OGRGeometry
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+from contextlib import nullcontext
 from datetime import datetime
+from functools import reduce
+import operator
 import django.contrib.gis.utils
 import sys
 import pytz
 
+from fixmyapp.management.diff import row_hash
+
 
 class LayerMapping(django.contrib.gis.utils.LayerMapping):
+    def __init__(self, *args, hash_field=None, **kwargs):
+        """
+        If `hash_field` is set, a hash of each feature's values is stored in
+        this model field and existing instances whose stored hash matches are
+        not written again. This requires `unique` to be set.
+        """
+        super().__init__(*args, **kwargs)
+        self.hash_field = hash_field
+        # Primary keys of the instances created or updated by `save`
+        self.changed = set()
+
     def save(
         self,
         verbose=False,
@@ -16,11 +34,22 @@ class LayerMapping(django.contrib.gis.utils.LayerMapping):
         silent=False,
         stream=sys.stdout,
         strict=False,
+        batch_size=None,
     ):
         """
         Create or update model instances, updating their geometries as well.
         Timezone unaware datetime fields are converted to timezone aware
         values by assuming they are in UTC.
+
+        If `batch_size` is set, features are saved in batches of that size.
+        Existing instances of a batch are retrieved with a single query and
+        written using `bulk_create` and `bulk_update`. If writing a batch fails
+        and `strict` is not set, its features are saved one by one so that
+        only failing features are skipped.
+
+        Returns:
+            tuple: The number of saved features and the number of processed
+                features
         """
         # Getting the default Feature ID range.
         default_range = self.check_fid_range(fid_range)
@@ -38,6 +67,9 @@ class LayerMapping(django.contrib.gis.utils.LayerMapping):
             else:
                 layer_iter = self.layer
 
+            # Features waiting to be saved in batched mode
+            batch = []
+
             for feat in layer_iter:
                 num_feat += 1
                 # Getting the keyword arguments
@@ -56,58 +88,32 @@ class LayerMapping(django.contrib.gis.utils.LayerMapping):
                         if type(kwargs[k]) == datetime and kwargs[k].tzinfo is None:
                             kwargs[k] = kwargs[k].replace(tzinfo=pytz.UTC)
 
-                    if self.unique:
-                        is_update = True
-                        try:
-                            # Constructing the model using the keyword args
-                            # If we want unique models on a particular field, handle the
-                            # geometry appropriately.
-                            # Getting the keyword arguments and retrieving
-                            # the unique model.
-                            u_kwargs = self.unique_kwargs(kwargs)
-                            m = self.model.objects.using(self.using).get(**u_kwargs)
-
-                            # Replace the geometry with the geometry from the
-                            # shape file
-                            new = OGRGeometry(kwargs[self.geom_field])
-                            setattr(m, self.geom_field, new.wkt)
-
-                            # Update existing model fields
-                            for k, v in kwargs.items():
-                                if k == self.geom_field:
-                                    continue
-
-                                setattr(m, k, v)
-                        except ObjectDoesNotExist:
-                            # No unique model exists yet, create.
-                            is_update = False
-                            m = self.model(**kwargs)
-                    else:
-                        is_update = False
-                        m = self.model(**kwargs)
-
-                    try:
-                        # Attempting to save.
-                        m.save(using=self.using)
-                        num_saved += 1
-                        if verbose:
-                            stream.write(
-                                '%s: %s\n' % ('Updated' if is_update else 'Saved', m)
-                            )
-                    except Exception as msg:
-                        if strict:
-                            # Bailing out if the `strict` keyword is set.
-                            if not silent:
-                                stream.write(
-                                    'Failed to save the feature (id: %s) into the '
-                                    'model with the keyword arguments:\n' % feat.fid
-                                )
-                                stream.write('%s\n' % kwargs)
-                            raise
-                        elif not silent:
-                            stream.write(
-                                'Failed to save %s:\n %s\nContinuing\n' % (kwargs, msg)
+                    if self.hash_field:
+                        kwargs[self.hash_field] = row_hash(kwargs)
+
+                    if batch_size:
+                        batch.append((feat.fid, kwargs))
+                        if len(batch) >= batch_size:
+                            num_saved += self._save_batch(
+                                batch, verbose, silent, stream, strict
                             )
+                            batch.clear()
+                    else:
+                        m, is_update = self._instance(kwargs)
+                        if m is None:
+                            # Unchanged instances are not written again
+                            num_saved += 1
+                        elif self._save_instance(
+                            m,
+                            is_update,
+                            feat.fid,
+                            kwargs,
+                            verbose,
+                            silent,
+                            stream,
+                            strict,
+                        ):
+                            num_saved += 1
 
                 # Printing progress information, if requested.
                 if progress and num_feat % progress_interval == 0:
@@ -115,6 +121,9 @@ class LayerMapping(django.contrib.gis.utils.LayerMapping):
                         'Processed %d features, saved %d ...\n' % (num_feat, num_saved)
                     )
 
+            if len(batch) > 0:
+                num_saved += self._save_batch(batch, verbose, silent, stream, strict)
+
             # Only used for status output purposes -- incremental saving uses the
             # values returned here.
             return num_saved, num_feat
@@ -142,13 +151,207 @@ class LayerMapping(django.contrib.gis.utils.LayerMapping):
                     step_slice = slice(beg, end)
 
                 try:
-                    num_feat, num_saved = _save(step_slice, num_feat, num_saved)
+                    num_saved, num_feat = _save(step_slice, num_feat, num_saved)
                     beg = end
                 except Exception:  # Deliberately catch everything
                     stream.write(
                         '%s\nFailed to save slice: %s\n' % ('=-' * 20, step_slice)
                     )
                     raise
+            return num_saved, num_feat
         else:
             # Otherwise, just calling the previously defined _save() function.
-            _save()
+            return _save()
+
+    def _update(self, m, kwargs):
+        """Update an existing model instance with feature keyword arguments"""
+        # Replace the geometry with the geometry from the shape file
+        new = OGRGeometry(kwargs[self.geom_field])
+        setattr(m, self.geom_field, new.wkt)
+
+        # Update existing model fields
+        for k, v in kwargs.items():
+            if k == self.geom_field:
+                continue
+
+            setattr(m, k, v)
+
+    def _instance(self, kwargs):
+        """Return the updated unique model instance or a new instance
+
+        Returns:
+            tuple: The model instance, or `None` if the existing instance is
+                unchanged, and whether it already exists
+        """
+        if self.unique:
+            try:
+                # If we want unique models on a particular field, retrieve
+                # the unique model using the uniqueness keyword arguments.
+                u_kwargs = self.unique_kwargs(kwargs)
+                m = self.model.objects.using(self.using).get(**u_kwargs)
+                if self._is_unchanged(m, kwargs):
+                    return None, True
+                self._update(m, kwargs)
+                return m, True
+            except ObjectDoesNotExist:
+                # No unique model exists yet, create.
+                pass
+        return self.model(**kwargs), False
+
+    def _is_unchanged(self, m, kwargs):
+        """Whether an existing instance was saved from identical values"""
+        return (
+            self.hash_field is not None
+            and getattr(m, self.hash_field) == kwargs[self.hash_field]
+        )
+
+    def _save_instance(
+        self,
+        m,
+        is_update,
+        fid,
+        kwargs,
+        verbose,
+        silent,
+        stream,
+        strict,
+        savepoint=False,
+    ):
+        """Save a single model instance
+
+        If `savepoint` is set, a failed save does not abort the surrounding
+        transaction.
+
+        Returns:
+            bool: Whether the instance was saved
+        """
+        try:
+            # Attempting to save.
+            with transaction.atomic(using=self.using) if savepoint else nullcontext():
+                m.save(using=self.using)
+            self.changed.add(m.pk)
+            if verbose:
+                stream.write('%s: %s\n' % ('Updated' if is_update else 'Saved', m))
+            return True
+        except Exception as msg:
+            if strict:
+                # Bailing out if the `strict` keyword is set.
+                if not silent:
+                    stream.write(
+                        'Failed to save the feature (id: %s) into the '
+                        'model with the keyword arguments:\n' % fid
+                    )
+                    stream.write('%s\n' % kwargs)
+                raise
+            elif not silent:
+                stream.write('Failed to save %s:\n %s\nContinuing\n' % (kwargs, msg))
+            return False
+
+    def _unique_fields(self):
+        return [self.unique] if isinstance(self.unique, str) else list(self.unique)
+
+    def _save_batch(self, batch, verbose, silent, stream, strict):
+        """Create or update the model instances of a batch of features
+
+        Parameters:
+            batch (list): Tuples of feature ids and keyword arguments
+
+        Returns:
+            int: The number of saved or unchanged instances
+        """
+        if self.unique:
+            fields = self._unique_fields()
+            keys = [tuple(kwargs[f] for f in fields) for _, kwargs in batch]
+            if len(fields) == 1:
+                query = Q(**{f'{fields[0]}__in': {key[0] for key in keys}})
+            else:
+                query = reduce(
+                    operator.or_, (Q(**dict(zip(fields, key))) for key in set(keys))
+                )
+            existing = {
+                tuple(getattr(m, f) for f in fields): m
+                for m in self.model.objects.using(self.using).filter(query)
+            }
+        else:
+            keys = range(len(batch))
+            existing = {}
+
+        # Later features with the same unique values update earlier ones
+        created, updated, unchanged = {}, {}, set()
+        for key, (fid, kwargs) in zip(keys, batch):
+            if key in existing:
+                if key not in updated and self._is_unchanged(existing[key], kwargs):
+                    unchanged.add(key)
+                    continue
+                unchanged.discard(key)
+                self._update(existing[key], kwargs)
+                updated[key] = (existing[key], fid, kwargs)
+            elif key in created:
+                self._update(created[key][0], kwargs)
+                created[key] = (created[key][0], fid, kwargs)
+            else:
+                created[key] = (self.model(**kwargs), fid, kwargs)
+
+        update_fields = self._update_fields(batch)
+        try:
+            with transaction.atomic(using=self.using):
+                for m, _, _ in updated.values():
+                    for field in self.model._meta.concrete_fields:
+                        if getattr(field, 'auto_now', False):
+                            field.pre_save(m, add=False)
+                self.model.objects.using(self.using).bulk_update(
+                    [m for m, _, _ in updated.values()], update_fields
+                )
+                self.model.objects.using(self.using).bulk_create(
+                    [m for m, _, _ in created.values()]
+                )
+        except Exception as msg:
+            if strict:
+                if not silent:
+                    stream.write(
+                        'Failed to save the features (ids: %s) into the model\n'
+                        % ', '.join(str(fid) for fid, _ in batch)
+                    )
+                raise
+            # Save features individually to skip only those that fail
+            if not silent:
+                stream.write('Failed to save batch:\n %s\nRetrying\n' % msg)
+            num_saved = len(unchanged)
+            for is_update, instances in ((True, updated), (False, created)):
+                for m, fid, kwargs in instances.values():
+                    num_saved += self._save_instance(
+                        m,
+                        is_update,
+                        fid,
+                        kwargs,
+                        verbose,
+                        silent,
+                        stream,
+                        strict,
+                        savepoint=True,
+                    )
+            return num_saved
+
+        for instances in (updated, created):
+            self.changed.update(m.pk for m, _, _ in instances.values())
+        if verbose:
+            for m, _, _ in updated.values():
+                stream.write('Updated: %s\n' % m)
+            for m, _, _ in created.values():
+                stream.write('Saved: %s\n' % m)
+        return len(updated) + len(created) + len(unchanged)
+
+    def _update_fields(self, batch):
+        """Names of the fields to write when updating existing instances"""
+        names = set()
+        for _, kwargs in batch:
+            names.update(kwargs.keys())
+        if self.unique:
+            names.difference_update(self._unique_fields())
+        names.update(
+            f.name
+            for f in self.model._meta.concrete_fields
+            if getattr(f, 'auto_now', False)
+        )
+        names.discard(self.model._meta.pk.name)
+        return sorted(names)
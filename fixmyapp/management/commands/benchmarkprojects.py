@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from fixmyapp.models import Project
+from fixmyapp.serializers import ProjectSerializer
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework_gis.fields import GeometryField
+import time
+
+
+class GEOSProjectSerializer(ProjectSerializer):
+    """Serializes the center and length computed by the model methods"""
+
+    center = GeometryField(precision=14)
+    length = serializers.DecimalField(None, 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the time of serializing the project list with center and '
+        'length computed by GEOS and by the database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='number of measurements, the fastest one is reported',
+        )
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/api/projects'))
+        queryset = (
+            Project.objects.filter(published=1)
+            .order_by('id')
+            .prefetch_related('faq', 'likes', 'photos')
+        )
+        count = queryset.count()
+
+        for label, serializer_class, projects in (
+            ('GEOS', GEOSProjectSerializer, queryset),
+            ('database', ProjectSerializer, queryset.with_measures()),
+        ):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                serializer_class(
+                    projects.all(), many=True, context={'request': request}
+                ).data
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(
+                f'{label}: {min(timings) * 1000:.1f} ms for {count} projects'
+            )
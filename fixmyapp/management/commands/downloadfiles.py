@@ -1,5 +1,45 @@
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.core.files.storage import default_storage
 from django.core.management import BaseCommand, CommandError
+import json
+import os
+
+# Records the ETag and size of each downloaded object
+MANIFEST_PATH = '/tmp/downloadfiles-manifest.json'
+
+MB = 1024 * 1024
+
+
+def read_manifest(path=MANIFEST_PATH):
+    """Read the manifest of downloaded files
+
+    Returns:
+        dict: Maps object keys to dicts with their `etag`, `size` and local
+            `path`
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(manifest, path=MANIFEST_PATH):
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.part', path)
+
+
+def is_current(entry, obj, target):
+    """Whether a manifest entry describes an unchanged, complete download"""
+    return (
+        entry is not None
+        and entry['etag'] == obj.e_tag
+        and entry['size'] == obj.size
+        and os.path.exists(target)
+        and os.path.getsize(target) == obj.size
+    )
 
 
 class Command(BaseCommand):
@@ -7,6 +47,26 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('dir', type=str, help='A directory in the bucket')
+        parser.add_argument(
+            '--target', type=str, default='/tmp', help='local target directory'
+        )
+        parser.add_argument(
+            '--manifest',
+            type=str,
+            default=MANIFEST_PATH,
+            help='file recording the ETag and size of downloaded files',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='number of files downloaded concurrently',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='download files even if they have not changed',
+        )
 
     def handle(self, *args, **options):
         if not options['dir'].endswith('/'):
@@ -14,26 +74,78 @@ class Command(BaseCommand):
         else:
             directory = options['dir']
 
-        if not default_storage.exists(directory):
+        bucket = default_storage.bucket
+        objects = [
+            obj
+            for obj in bucket.objects.filter(Prefix=directory)
+            if obj.key != directory and '/' not in obj.key[len(directory) :]
+        ]
+
+        if len(objects) == 0:
             raise CommandError(
-                'The directory {} does not exist in bucket.'.format(directory)
+                'The directory {} does not exist in bucket or is empty.'.format(
+                    directory
+                )
             )
 
-        files = default_storage.listdir(directory)[1]
+        manifest = read_manifest(options['manifest'])
+        downloads = []
+        for obj in objects:
+            target = os.path.join(options['target'], obj.key[len(directory) :])
+            if not options['force'] and is_current(manifest.get(obj.key), obj, target):
+                if options['verbosity'] > 1:
+                    self.stdout.write('Skipped unchanged "{}".'.format(obj.key))
+            else:
+                downloads.append((obj, target))
+
+        # Large files are downloaded in concurrent ranges
+        config = TransferConfig(
+            multipart_threshold=16 * MB, multipart_chunksize=16 * MB, max_concurrency=4
+        )
 
-        valid_files = [f for f in files if f != '' and f != '.']
+        def download(obj, target):
+            # The client, unlike resources, is safe to share between threads
+            bucket.meta.client.download_file(
+                bucket.name, obj.key, target + '.part', Config=config
+            )
+            os.replace(target + '.part', target)
+            return obj, target
 
-        if len(valid_files) == 0:
-            raise CommandError('The directory {} is empty'.format(directory))
+        errors = []
+        try:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                futures = [executor.submit(download, *d) for d in downloads]
+                for future in as_completed(futures):
+                    try:
+                        obj, target = future.result()
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    manifest[obj.key] = {
+                        'etag': obj.e_tag,
+                        'size': obj.size,
+                        'path': target,
+                    }
+                    if options['verbosity'] > 1:
+                        self.stdout.write(
+                            'Successfully downloaded "{}" to "{}".'.format(
+                                obj.key, target
+                            )
+                        )
+        finally:
+            # Record completed downloads even if others failed
+            write_manifest(manifest, options['manifest'])
 
-        for file in valid_files:
-            target = '/tmp/' + file
-            key = directory + file
-            default_storage.bucket.download_file(key, target)
-            if options['verbosity'] > 1:
-                self.stdout.write(
-                    'Successfully downloaded "{}" to "{}".'.format(key, target)
+        if len(errors) > 0:
+            raise CommandError(
+                '{} of {} downloads failed: {}'.format(
+                    len(errors), len(downloads), errors[0]
                 )
+            ) from errors[0]
 
         if options['verbosity'] > 0:
-            self.stdout.write('Finished downloading files from bucket.')
+            self.stdout.write(
+                'Finished downloading {} of {} files from bucket.'.format(
+                    len(downloads), len(objects)
+                )
+            )
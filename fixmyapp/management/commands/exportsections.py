@@ -1,7 +1,124 @@
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
 from fixmyapp.models import Section
 import argparse
 import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import textwrap
+
+CHUNK_SIZE = 2000
+
+
+def score(instance, name):
+    """Return a stored HBI score rounded to three decimals
+
+    Falls back to computing the score with the model method of the same name
+    if it has not been stored yet.
+    """
+    value = getattr(instance, 'hbi_' + name)
+    if value is None:
+        value = getattr(instance, name)()
+    return round(float(value), 3)
+
+
+def serialize_section(s):
+    feature = {
+        'type': 'Feature',
+        'geometry': json.loads(s.geometry.json),
+        'properties': {
+            'id': s.pk,
+            'street_name': s.street_name,
+            'suffix': s.suffix,
+            'borough': s.borough,
+            'street_category': s.street_category,
+            'is_road': s.is_road,
+        },
+    }
+
+    # the HBI methods are not configured to handle the fake data that
+    # we have for intersections at the moment, so these fields are only
+    # populated when `section.is_road`
+
+    if s.is_road is True:
+        feature['properties']['velocity'] = score(s, 'velocity_index')
+        feature['properties']['safety'] = score(s, 'safety_index')
+
+        for detail in s.details.all():
+            orientation = detail.orientation
+            velocity = score(detail, 'velocity_index')
+            safety = score(detail, 'safety_index')
+
+            prefix = 'side{}_'.format(detail.side)
+            feature['properties'][prefix + 'orientation'] = orientation
+            feature['properties'][prefix + 'velocity'] = velocity
+            feature['properties'][prefix + 'safety'] = safety
+
+    for entry in s.accidents.all():
+        feature['properties'][f'side{entry.side}_killed'] = entry.killed
+        feature['properties'][
+            f'side{entry.side}_severely_injured'
+        ] = entry.severely_injured
+        feature['properties'][
+            f'side{entry.side}_slightly_injured'
+        ] = entry.slightly_injured
+        feature['properties'][f'side{entry.side}_source'] = entry.source
+        feature['properties'][f'side{entry.side}_risk_level'] = entry.risk_level
+
+    return feature
+
+
+def iter_sections(queryset, chunk_size=CHUNK_SIZE):
+    """Iterate over sections in chunks of ascending primary keys
+
+    Each chunk is fetched with its own query and prefetches details and
+    accidents, so that only one chunk is held in memory at a time.
+    """
+    queryset = queryset.order_by('pk').prefetch_related('details', 'accidents')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            break
+        last_pk = chunk[-1].pk
+
+
+def write_features(queryset, file, indent=None, chunk_size=CHUNK_SIZE):
+    """Write the features of a section queryset as a comma-separated list
+
+    Returns:
+        int: The number of features written
+    """
+    count = 0
+    for s in iter_sections(queryset, chunk_size):
+        feature = json.dumps(serialize_section(s), indent=indent, ensure_ascii=False)
+        if indent is not None:
+            feature = textwrap.indent(feature, ' ' * indent * 2)
+        if count > 0:
+            file.write(',\n' if indent is not None else ', ')
+        file.write(feature)
+        count += 1
+    return count
+
+
+def export_shard(args):
+    """Export sections in the primary key range [start, end) to a temp file
+
+    Runs in a worker process, returns the name of the file and the number of
+    features written to it.
+    """
+    start, end, indent, chunk_size = args
+    queryset = Section.objects.filter(pk__gte=start, pk__lt=end)
+    with tempfile.NamedTemporaryFile(
+        mode='w', encoding='UTF-8', suffix='.geojson', delete=False
+    ) as f:
+        count = write_features(queryset, f, indent, chunk_size)
+    return f.name, count
 
 
 class Command(BaseCommand):
@@ -15,53 +132,70 @@ class Command(BaseCommand):
             default=2,
             help='indentation level for pretty printing',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='number of sections fetched per query',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='number of processes exporting disjoint id ranges',
+        )
 
     def handle(self, *args, **options):
-        result = {'type': 'FeatureCollection', 'features': []}
-
-        for s in Section.objects.all():
-            feature = {
-                'type': 'Feature',
-                'geometry': json.loads(s.geometry.json),
-                'properties': {
-                    'id': s.pk,
-                    'street_name': s.street_name,
-                    'suffix': s.suffix,
-                    'borough': s.borough,
-                    'street_category': s.street_category,
-                    'is_road': s.is_road,
-                },
-            }
-
-            # the HBI methods are not configured to handle the fake data that
-            # we have for intersections at the moment, so these fields are only
-            # populated when `section.is_road`
-
-            if s.is_road is True:
-                feature['properties']['velocity'] = float(round(s.velocity_index(), 3))
-                feature['properties']['safety'] = float(round(s.safety_index(), 3))
-
-                for detail in s.details.all():
-                    orientation = detail.orientation
-                    velocity = float(round(detail.velocity_index(), 3))
-                    safety = float(round(detail.safety_index(), 3))
-
-                    prefix = 'side{}_'.format(detail.side)
-                    feature['properties'][prefix + 'orientation'] = orientation
-                    feature['properties'][prefix + 'velocity'] = velocity
-                    feature['properties'][prefix + 'safety'] = safety
-
-            for entry in s.accidents.all():
-                feature['properties'][f'side{entry.side}_killed'] = entry.killed
-                feature['properties'][
-                    f'side{entry.side}_severely_injured'
-                ] = entry.severely_injured
-                feature['properties'][
-                    f'side{entry.side}_slightly_injured'
-                ] = entry.slightly_injured
-                feature['properties'][f'side{entry.side}_source'] = entry.source
-                feature['properties'][f'side{entry.side}_risk_level'] = entry.risk_level
-
-            result['features'].append(feature)
-
-        json.dump(result, options['file'], indent=options['indent'], ensure_ascii=False)
+        file = options['file']
+        indent = options['indent']
+        newline = '\n' if indent is not None else ''
+
+        if indent is not None:
+            file.write('{\n%s"type": "FeatureCollection",\n' % (' ' * indent))
+            file.write('%s"features": [\n' % (' ' * indent))
+        else:
+            file.write('{"type": "FeatureCollection", "features": [')
+
+        if options['workers'] > 1:
+            self.export_parallel(file, indent, options)
+        else:
+            write_features(Section.objects.all(), file, indent, options['chunk_size'])
+
+        if indent is not None:
+            file.write('\n%s]\n}' % (' ' * indent))
+        else:
+            file.write(']}')
+        file.write(newline)
+        file.close()
+
+    def export_parallel(self, file, indent, options):
+        bounds = Section.objects.aggregate(start=Min('pk'), end=Max('pk'))
+        if bounds['start'] is None:
+            return
+
+        workers = options['workers']
+        step = (bounds['end'] - bounds['start']) // workers + 1
+        shards = [
+            (
+                bounds['start'] + i * step,
+                bounds['start'] + (i + 1) * step,
+                indent,
+                options['chunk_size'],
+            )
+            for i in range(workers)
+        ]
+
+        # Database connections must not be shared with forked processes
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.map(export_shard, shards)
+
+        written = 0
+        for name, count in results:
+            if count > 0:
+                if written > 0:
+                    file.write(',\n' if indent is not None else ', ')
+                with open(name, encoding='UTF-8') as shard:
+                    shutil.copyfileobj(shard, file)
+                written += count
+            os.remove(name)
@@ -0,0 +1,174 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from fixmyapp import tiles
+from fixmyapp.geo import MAX_ZOOM, MIN_ZOOM
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+
+SCHEMA = '''
+    CREATE TABLE metadata (name TEXT, value TEXT);
+    CREATE TABLE tiles (
+        zoom_level INTEGER,
+        tile_column INTEGER,
+        tile_row INTEGER,
+        tile_data BLOB
+    );
+    CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+'''
+
+
+def tile_range(bounds, zoom):
+    """Range of x and y coordinates of tiles covering a bounding box"""
+    n = 2**zoom
+
+    def x(lon):
+        return min(n - 1, max(0, math.floor((lon + 180) / 360 * n)))
+
+    def y(lat):
+        lat = math.radians(max(-85.0511, min(85.0511, lat)))
+        return min(
+            n - 1,
+            max(0, math.floor((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)),
+        )
+
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return range(x(min_lon), x(max_lon) + 1), range(y(max_lat), y(min_lat) + 1)
+
+
+def render_tile(args):
+    """Render a tile containing all given layers
+
+    Runs in a worker process. Encoded vector tiles can be concatenated, so the
+    tile is made up of the tiles of the individual layers. Also returns
+    whether any layer has features in the tile, as its children can only
+    have features in that case.
+    """
+    layers, z, x, y = args
+    data = b''.join(tiles.LAYERS[name].render(z, x, y) for name in layers)
+    has_features = len(data) > 0 or any(
+        tiles.LAYERS[name].has_features(z, x, y) for name in layers
+    )
+    return x, y, data, has_features
+
+
+class Command(BaseCommand):
+    help = 'Renders vector tiles into an MBTiles file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', type=str, help='MBTiles file to create')
+        parser.add_argument(
+            '--layers',
+            nargs='+',
+            choices=sorted(tiles.LAYERS),
+            default=['sections', 'projects'],
+            help='layers to include',
+        )
+        parser.add_argument('--min-zoom', type=int, default=10)
+        parser.add_argument('--max-zoom', type=int, default=16)
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='number of processes rendering tiles',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of tiles written per transaction',
+        )
+
+    def handle(self, *args, **options):
+        min_zoom, max_zoom = options['min_zoom'], options['max_zoom']
+        if not MIN_ZOOM <= min_zoom <= max_zoom <= MAX_ZOOM:
+            raise CommandError(f'Zoom levels must be between {MIN_ZOOM} and {MAX_ZOOM}')
+        if os.path.exists(options['file']):
+            raise CommandError(f'{options["file"]} already exists')
+
+        layers = options['layers']
+        extents = [e for e in (tiles.LAYERS[n].extent() for n in layers) if e]
+        if len(extents) == 0:
+            raise CommandError('There are no features to render')
+        bounds = (
+            min(e[0] for e in extents),
+            min(e[1] for e in extents),
+            max(e[2] for e in extents),
+            max(e[3] for e in extents),
+        )
+
+        db = sqlite3.connect(options['file'])
+        db.executescript(SCHEMA)
+        self.write_metadata(db, layers, bounds, min_zoom, max_zoom)
+
+        xs, ys = tile_range(bounds, min_zoom)
+        candidates = [(x, y) for x in xs for y in ys]
+        count = 0
+
+        # Database connections must not be shared with forked processes
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            for z in range(min_zoom, max_zoom + 1):
+                parents = []
+                rendered = 0
+                batch = []
+                for x, y, data, has_features in pool.imap_unordered(
+                    render_tile,
+                    ((layers, z, x, y) for x, y in candidates),
+                    chunksize=16,
+                ):
+                    # Tiles without any features have no features in their
+                    # children either, so these are skipped
+                    if has_features:
+                        parents.append((x, y))
+                    # Tiles can be empty although their children are not,
+                    # e.g. if features are too small to be encoded
+                    if len(data) == 0:
+                        continue
+                    rendered += 1
+                    # MBTiles uses the TMS scheme, which numbers rows from
+                    # south to north
+                    batch.append((z, x, 2**z - 1 - y, gzip.compress(data)))
+                    if len(batch) >= options['batch_size']:
+                        self.write_tiles(db, batch)
+                        batch = []
+                self.write_tiles(db, batch)
+                count += rendered
+
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'Rendered {rendered} tiles at zoom {z}')
+
+                candidates = [
+                    (2 * x + dx, 2 * y + dy)
+                    for x, y in parents
+                    for dx in (0, 1)
+                    for dy in (0, 1)
+                ]
+
+        db.close()
+        self.stdout.write(f'Wrote {count} tiles to {options["file"]}')
+
+    def write_tiles(self, db, batch):
+        with db:
+            db.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', batch)
+
+    def write_metadata(self, db, layers, bounds, min_zoom, max_zoom):
+        metadata = {
+            'name': ', '.join(layers),
+            'format': 'pbf',
+            'type': 'overlay',
+            'bounds': ','.join(str(c) for c in bounds),
+            'center': '{},{},{}'.format(
+                (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, min_zoom
+            ),
+            'minzoom': str(min_zoom),
+            'maxzoom': str(max_zoom),
+            'json': json.dumps(
+                {'vector_layers': [{'id': name, 'fields': {}} for name in layers]}
+            ),
+        }
+        with db:
+            db.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
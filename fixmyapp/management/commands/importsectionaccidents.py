@@ -1,14 +1,17 @@
 import argparse
 import csv
+import itertools
 import json
 import logging
 import sys
 
 from django.core.management.base import BaseCommand
-from django.db.utils import IntegrityError
+from django.db import transaction
+from django.utils import timezone
+from fixmyapp import tiles
 from fixmyapp.management.csv_tools import MissingFieldError, validate_reader
-from fixmyapp.models import SectionAccidents
-from psycopg2.errors import ForeignKeyViolation, UniqueViolation
+from fixmyapp.management.diff import row_hash, write_ids
+from fixmyapp.models import Section, SectionAccidents
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,11 @@ MAPPING = {
     'risk_level': 'risk_level',
 }
 
+# Fields written when updating changed datasets
+UPDATE_FIELDS = [
+    name for name in MAPPING.values() if name not in ('section_id', 'side')
+] + ['row_hash', 'modified_date']
+
 
 class Command(BaseCommand):
     help = 'Import an accident dataset for existing sections'
@@ -42,51 +50,126 @@ class Command(BaseCommand):
             dest='skip_confirmation',
             help='skip confirmation before overwriting data',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of rows inserted per query',
+        )
+        parser.add_argument(
+            '--changed-ids',
+            type=str,
+            help='file to which the ids of sections with changed accident '
+            'data are written',
+        )
 
-    def user_confirm_import(self, data, skip_confirmation=False):
+    def user_confirm_import(self, skip_confirmation=False):
         """Ask user to confirm potentially destructive action."""
-        prompt = f'Delete existing data and import {len(data)} new data sets?'
+        prompt = 'Replace existing data with new data sets?'
         if skip_confirmation is False:
             if input(prompt) != '':
                 logger.info('Import cancelled')
                 sys.exit(0)
-        else:
-            logger.info(f"Importing {len(data)} datasets")
 
-    def handle(self, *args, **options):
-        reader = csv.DictReader(options['file'])
+    def exit_with_encoding_error(self, file):
+        self.stderr.write(f"Error reading {file} using UTF-8 codec.")
+        sys.exit(1)
 
-        try:
-            data = list(reader)
-        except UnicodeDecodeError:
-            self.stderr.write(f"Error reading {options['file']} using UTF-8 codec.")
-            sys.exit(1)
+    def import_from_reader(self, reader, batch_size=1000):
+        """Import rows from a CSV reader in batches.
 
-        try:
-            validate_reader(reader, [k for k in MAPPING.keys()])
-        except MissingFieldError as err:
-            logger.error(err)
-            sys.exit(1)
+        Only differences to the stored datasets are written: Rows are compared
+        with the stored datasets using a hash of their values, new and changed
+        rows are written and datasets that are no longer contained in the data
+        are deleted. Rows referencing missing sections and rows for section
+        sides that were already imported are skipped.
 
-        self.user_confirm_import(data, skip_confirmation=options['skip_confirmation'])
+        Returns:
+            set: Ids of sections whose accident data changed
+        """
+        section_ids = set(Section.objects.values_list('id', flat=True))
+        existing = {
+            (section_id, side): (pk, digest)
+            for pk, section_id, side, digest in SectionAccidents.objects.values_list(
+                'pk', 'section_id', 'side', 'row_hash'
+            )
+        }
+        imported = set()
+        changed = set()
 
-        SectionAccidents.objects.all().delete()
-        for row in data:
-            data = {MAPPING[key]: row[key] for key in MAPPING}
+        rows = iter(reader)
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if len(chunk) == 0:
+                break
 
-            try:
-                SectionAccidents.objects.create(**data)
-            except IntegrityError as e:
-                # Django stores the original db-level exception on `__cause__`
-                # when wrapping it in a Django error type
-                if type(e.__cause__) == ForeignKeyViolation:
+            created = []
+            updated = []
+            for row in chunk:
+                key = (int(row['section_id']), int(row['side']))
+                if key[0] not in section_ids:
                     logger.warning(
                         f"Skipped importing section accidents for missing section {row['section_id']}"
                     )
-                elif type(e.__cause__) == UniqueViolation:
+                    continue
+                elif key in imported:
                     logger.warning(
                         "Skipped importing duplicate section accidents for side "
                         f"{row['side']} of section {row['section_id']}"
                     )
+                    continue
+
+                imported.add(key)
+                kwargs = {MAPPING[k]: row[k] for k in MAPPING}
+                digest = row_hash(kwargs)
+                if key not in existing:
+                    created.append(SectionAccidents(row_hash=digest, **kwargs))
+                elif existing[key][1] != digest:
+                    updated.append(
+                        SectionAccidents(
+                            pk=existing[key][0],
+                            row_hash=digest,
+                            modified_date=timezone.now(),
+                            **kwargs,
+                        )
+                    )
                 else:
-                    raise
+                    continue
+                changed.add(key[0])
+
+            SectionAccidents.objects.bulk_create(created)
+            SectionAccidents.objects.bulk_update(updated, UPDATE_FIELDS)
+
+        removed = existing.keys() - imported
+        SectionAccidents.objects.filter(
+            pk__in=[existing[key][0] for key in removed]
+        ).delete()
+        changed.update(section_id for section_id, _ in removed)
+        return changed
+
+    def handle(self, *args, **options):
+        reader = csv.DictReader(options['file'])
+
+        try:
+            validate_reader(reader, [k for k in MAPPING.keys()])
+        except MissingFieldError as err:
+            logger.error(err)
+            sys.exit(1)
+        except UnicodeDecodeError:
+            self.exit_with_encoding_error(options['file'])
+
+        self.user_confirm_import(skip_confirmation=options['skip_confirmation'])
+
+        try:
+            with transaction.atomic():
+                changed = self.import_from_reader(reader, options['batch_size'])
+        except UnicodeDecodeError:
+            self.exit_with_encoding_error(options['file'])
+
+        if options['changed_ids']:
+            write_ids(changed, options['changed_ids'])
+
+        # Bulk writes do not send the signals that invalidate cached tiles
+        if len(changed) > 0:
+            tiles.invalidate('sections')
+        logger.info(f"Updated datasets of {len(changed)} sections")
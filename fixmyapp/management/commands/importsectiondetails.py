@@ -1,13 +1,18 @@
 import argparse
 import csv
+import itertools
 import logging
 import sys
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
-from django.db.utils import IntegrityError
-from fixmyapp.models import Photo, SectionDetails
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from fixmyapp import hbi
+from fixmyapp.models import Photo, Section, SectionDetails
 from fixmyapp.management.csv_tools import MissingFieldError, validate_reader
-from psycopg2.errors import ForeignKeyViolation, UniqueViolation
+from fixmyapp.management.diff import row_hash, write_ids
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +45,12 @@ MAPPING = {
 }
 
 
+# Fields written when updating changed details
+UPDATE_FIELDS = [
+    name for name in MAPPING.values() if name not in ('section_id', 'side')
+] + ['row_hash', 'modified_date']
+
+
 class Command(BaseCommand):
     help = 'Imports section details'
 
@@ -47,41 +58,136 @@ class Command(BaseCommand):
         parser.add_argument(
             'file', type=argparse.FileType('r'), default=sys.stdin, help='A CSV file'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of rows inserted per query',
+        )
+        parser.add_argument(
+            '--changed-ids',
+            type=str,
+            help='file to which the ids of sections with changed details are '
+            'written',
+        )
+
+    def import_from_reader(self, reader, batch_size=1000):
+        """Import data.
+
+        Only differences to the stored details are written: Rows are compared
+        with the stored details using a hash of their values, new and changed
+        rows are written in batches and details that are no longer contained
+        in the data are deleted. Rows referencing missing sections and
+        duplicate rows for a section side are skipped.
+
+        Returns:
+            set: Ids of sections whose details changed
+        """
+        existing = {
+            (section_id, side): (pk, digest)
+            for pk, section_id, side, digest in SectionDetails.objects.values_list(
+                'pk', 'section_id', 'side', 'row_hash'
+            )
+        }
+        imported = set()
+        changed = set()
+
+        rows = (row for row in reader if row['exist'] == '1')
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if len(batch) == 0:
+                break
+            changed |= self.import_batch(batch, existing, imported, batch_size)
 
-    def import_from_reader(self, reader):
-        """Import data."""
+        removed = existing.keys() - imported
+        # Photos are deleted along with the details
+        SectionDetails.objects.filter(
+            pk__in=[existing[key][0] for key in removed]
+        ).delete()
+        changed.update(section_id for section_id, _ in removed)
+        return changed
 
-        for row in (row for row in reader if row['exist'] == '1'):
+    def import_batch(self, rows, existing, imported, batch_size):
+        """Write new and changed rows
+
+        Parameters:
+            existing (dict): Maps section ids and sides of stored details to
+                their primary key and hash
+            imported (set): Section ids and sides of the rows imported so far
+
+        Returns:
+            set: Ids of sections whose details changed
+        """
+        section_ids = {int(row['section_id']) for row in rows}
+        sections = Section.objects.only('id').in_bulk(section_ids)
+
+        created = []
+        updated = []
+        pics = []
+        changed = set()
+        for row in rows:
             # Marshall CSV key names and formatting to Model format
             kwargs = {MAPPING[key]: row[key].replace(',', '.') for key in MAPPING}
+            key = (int(row['section_id']), int(row['side']))
+
+            if key[0] not in sections:
+                logger.warning(
+                    "Skipped importing section details for missing section "
+                    f"{row['section_id']}"
+                )
+                continue
+            elif key in imported:
+                logger.warning(
+                    "Skipped importing duplicate section detail for side "
+                    f"{row['side']} of section {row['section_id']}"
+                )
+                continue
+
+            imported.add(key)
+            digest = row_hash([kwargs, row['rva_pics']])
+            if key not in existing:
+                obj = SectionDetails(row_hash=digest, **kwargs)
+                created.append(obj)
+            elif existing[key][1] != digest:
+                obj = SectionDetails(
+                    pk=existing[key][0],
+                    row_hash=digest,
+                    modified_date=timezone.now(),
+                    **kwargs,
+                )
+                updated.append(obj)
+            else:
+                continue
+            pics.append((obj, row['rva_pics'].split()))
+            changed.add(key[0])
 
-            try:
-                obj, created = SectionDetails.objects.update_or_create(**kwargs)
-                for path in row['rva_pics'].split():
-                    photo = Photo(
-                        content_object=obj,
-                        copyright='Geoportal Berlin / Radverkehrsanlagen',
-                        src='rva_pics{}'.format(path),
-                    )
-                    photo.save()
-            except IntegrityError as e:
-                # Django stores the original db-level exception on `__cause__`
-                # when wrapping it in a Django error type
-                if type(e.__cause__) == ForeignKeyViolation:
-                    logger.warning(
-                        "Skipped importing section details for missing section "
-                        f"{row['section_id']}"
-                    )
-                elif type(e.__cause__) == UniqueViolation:
-                    logger.warning(
-                        "Skipped importing duplicate section detail for side "
-                        f"{row['side']} of section {row['section_id']}"
-                    )
-                else:
-                    raise
+        # Primary keys are set on the created objects on PostgreSQL
+        SectionDetails.objects.bulk_create(created, batch_size=batch_size)
+        SectionDetails.objects.bulk_update(
+            updated, UPDATE_FIELDS, batch_size=batch_size
+        )
+
+        content_type = ContentType.objects.get_for_model(SectionDetails)
+        Photo.objects.filter(
+            content_type=content_type, object_id__in=[obj.pk for obj in updated]
+        ).delete()
+        Photo.objects.bulk_create(
+            [
+                Photo(
+                    content_type=content_type,
+                    object_id=obj.pk,
+                    copyright='Geoportal Berlin / Radverkehrsanlagen',
+                    src='rva_pics{}'.format(path),
+                )
+                for obj, paths in pics
+                for path in paths
+            ],
+            batch_size=batch_size,
+        )
+
+        return changed
 
     def handle(self, *args, **options):
-        SectionDetails.objects.all().delete()
         reader = csv.DictReader(options['file'])
 
         expected_fields = [k for k in MAPPING.keys()] + ['rva_pics']
@@ -91,4 +197,15 @@ class Command(BaseCommand):
             logger.error(err)
             sys.exit(1)
 
-        self.import_from_reader(reader)
+        with transaction.atomic():
+            changed = self.import_from_reader(reader, options['batch_size'])
+            # Sections that were not scored before, e.g. because they were
+            # just imported, are scored even if they have no details
+            sections = Section.objects.filter(
+                Q(id__in=changed) | Q(hbi_happy_bike_index__isnull=True)
+            )
+            if sections.exists():
+                hbi.update_scores(sections)
+
+        if options['changed_ids']:
+            write_ids(changed, options['changed_ids'])
@@ -1,9 +1,14 @@
-from django.db import transaction
+from django.db import connections, transaction
 from django.core.management.base import BaseCommand
 from django.contrib.gis.utils.layermapping import LayerMapError
-from django.contrib.gis.utils import LayerMapping
+from fixmyapp import tiles
+from fixmyapp.management.diff import write_ids
 from fixmyapp.models import Section
+import multiprocessing
 import os
+import sys
+
+from . import LayerMapping
 
 # The `category` field is not read beacuse it's formatted as a roman numeral,
 # which LayerMapping can not read. If we want to use a street's actual category
@@ -19,7 +24,32 @@ mapping = {
 }
 
 
+def import_range(args):
+    """Import a range of features, returns the numbers of saved and processed
+    features and the ids of changed sections
+
+    Runs in a worker process, which opens its own data source and database
+    connection."""
+    path, fid_range, save_kwargs = args
+    lm = LayerMapping(
+        Section,
+        path,
+        mapping,
+        transform=True,
+        encoding='utf-8',
+        unique=('id',),
+        hash_field='row_hash',
+    )
+    return (*lm.save(fid_range=fid_range, **save_kwargs), lm.changed)
+
+
 class Command(BaseCommand):
+    """Import sections, creating new sections and updating existing ones
+
+    Sections are stored with a hash of their feature's values. Sections whose
+    feature has not changed since it was last imported are not written again.
+    """
+
     help = 'Imports sections'
 
     def add_arguments(self, parser):
@@ -30,34 +60,97 @@ class Command(BaseCommand):
             dest='progress',
             help='display the progress bar in any verbosity level.',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of features saved at once, 0 to save them one by one',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='number of processes importing disjoint ranges of features',
+        )
         parser.add_argument(
             '--delete',
             action='store_true',
             help='delete all existing sections before import',
         )
+        parser.add_argument(
+            '--changed-ids',
+            type=str,
+            help='file to which the ids of created, updated and deleted '
+            'sections are written',
+        )
 
     def handle(self, *args, **options):
+        path = os.path.abspath(options['file'])
 
+        deleted = set()
         try:
             with transaction.atomic():
                 if options['delete'] is True:
+                    deleted = set(Section.objects.values_list('id', flat=True))
                     Section.objects.all().delete()
                 lm = LayerMapping(
                     Section,
-                    os.path.abspath(options['file']),
+                    path,
                     mapping,
                     transform=True,
                     encoding='utf-8',
                     unique=('id',),
+                    hash_field='row_hash',
                 )
         except LayerMapError as e:
             self.stderr.write(f"Error importing sections from {options['file']}: {e}")
             sys.exit(1)
+
+        save_kwargs = {
+            'verbose': True if options['verbosity'] > 2 else False,
+            'progress': options['progress'] or options['verbosity'] > 1,
+            'silent': options['verbosity'] == 0,
+            'strict': True,
+            'batch_size': options['batch_size'],
+        }
+        if options['processes'] > 1:
+            changed = self.import_parallel(
+                path, lm.layer.num_feat, save_kwargs, options
+            )
         else:
-            lm.save(
-                verbose=True if options['verbosity'] > 2 else False,
-                progress=options['progress'] or options['verbosity'] > 1,
-                silent=options['verbosity'] == 0,
-                stream=self.stdout,
-                strict=True,
+            lm.save(stream=self.stdout, **save_kwargs)
+            changed = lm.changed
+        changed |= deleted
+
+        if options['changed_ids']:
+            write_ids(changed, options['changed_ids'])
+
+        # Bulk writes do not send the signals that invalidate cached tiles
+        if len(changed) > 0:
+            tiles.invalidate('sections')
+
+    def import_parallel(self, path, num_feat, save_kwargs, options):
+        """Import ranges of features in separate processes
+
+        Each range is imported in its own transaction. Output of the workers
+        is written to stdout of their process.
+
+        Returns:
+            set: Ids of the created and updated sections
+        """
+        step = num_feat // options['processes'] + 1
+        ranges = [(i, min(i + step, num_feat)) for i in range(0, num_feat, step)]
+
+        # Database connections must not be shared with forked processes
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            results = pool.map(import_range, [(path, r, save_kwargs) for r in ranges])
+
+        changed = set()
+        for (begin, end), (num_saved, num_processed, ids) in zip(ranges, results):
+            self.stdout.write(
+                f'Features {begin} to {end - 1}: saved {num_saved}, '
+                f'failed {num_processed - num_saved}'
             )
+            changed |= ids
+        return changed
@@ -1,18 +1,82 @@
+import multiprocessing
 import os
 import sys
 import logging
+import tempfile
+from django.contrib.gis.gdal import DataSource
 from django.core import management
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from fixmyapp import staging
+from fixmyapp.management.diff import read_ids, write_ids
+from fixmyapp.models import Section, SectionAccidents, SectionDetails
+from .downloadfiles import read_manifest, write_manifest
 
 FPATH_ROAD_SECTIONS = '/tmp/road_sections-v1.1.shp'
 FPATH_INTERSECTIONS = '/tmp/intersections-v1.1.shp'
 FPATH_SECTION_DETAILS = '/tmp/section_details-v1.1.csv'
 FPATH_SECTION_ACCIDENTS = '/tmp/section_accidents-v1.1.csv'
+INPUT_FILES = (
+    FPATH_ROAD_SECTIONS,
+    FPATH_INTERSECTIONS,
+    FPATH_SECTION_DETAILS,
+    FPATH_SECTION_ACCIDENTS,
+)
+
+# Files making up a shapefile besides the .shp file, the section attributes
+# are stored in the .dbf file
+SHAPEFILE_COMPONENTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+# Records the ETags of the input files of the last successful import
+FPATH_IMPORTED = '/tmp/updatehbi-imported.json'
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def file_etags(manifest):
+    """Map local paths to ETags in a manifest written by `downloadfiles`"""
+    return {entry['path']: entry['etag'] for entry in manifest.values()}
+
+
+def dataset_files(path):
+    """Files making up an input dataset, all components of a shapefile"""
+    root, extension = os.path.splitext(path)
+    if extension != '.shp':
+        return (path,)
+    return tuple(root + component for component in SHAPEFILE_COMPONENTS)
+
+
+def changed_datasets(downloaded, imported, force=False):
+    """Input datasets with files that changed since they were last imported
+
+    Optional shapefile components that are neither downloaded nor imported
+    are ignored.
+
+    Parameters:
+        downloaded (dict): Maps local paths to ETags of the downloaded files
+        imported (dict): Maps local paths to ETags of the files of the last
+            successful import
+        force (bool): Consider all datasets changed
+
+    Returns:
+        set: Paths of the changed datasets among `INPUT_FILES`
+    """
+    return {
+        path
+        for path in INPUT_FILES
+        if force
+        or path not in downloaded
+        or any(imported.get(f) != downloaded.get(f) for f in dataset_files(path))
+    }
+
+
+def imported_files(downloaded):
+    """ETags of all files of the input datasets, to be recorded after an
+    import"""
+    return {f: downloaded.get(f) for path in INPUT_FILES for f in dataset_files(path)}
+
+
 class Command(BaseCommand):
     """Load current data for HBI from S3, overwriting current data.
 
@@ -21,13 +85,24 @@ class Command(BaseCommand):
     - createinitialrevisions
     - migrate
     - downloadfiles
-    - importsections
+    - importsections, for road sections and intersections concurrently
     - importsectiondetails
     - importsectionaccidents
 
     in this order. Command parameters are specified using the constants
     defined at the top of this file. If one of the files does not exist in S3, an
     appropriate warning is emitted before importing any data.
+
+    Data is imported into staging tables, see `fixmyapp.staging`, and only
+    replaces the current sections, details and accident data after all imports
+    have succeeded and the new dataset has been validated. Import stages whose
+    input files have not changed since the last successful import are skipped.
+
+    With `--incremental`, only the rows that differ from the current data are
+    written, directly to the current tables in a single transaction. In both
+    modes, sections that are missing from the sections files are deleted, and
+    the ids of sections whose data changed can be written to a file to
+    update derived data such as exports for just these sections.
     """
 
     help = 'Load current sections and projects from S3, overwriting current data'
@@ -36,7 +111,31 @@ class Command(BaseCommand):
         parser.add_argument(
             '--delete',
             action='store_true',
-            help='delete all existing sections before import',
+            help='import sections even if their files have not changed, into '
+            'empty staging tables instead of a copy of the current sections '
+            'unless --incremental is given. Sections missing from the files '
+            'are deleted in any case.',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='number of processes used to import each sections file',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='import all files even if they have not changed',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='update changed rows in place instead of replacing the dataset',
+        )
+        parser.add_argument(
+            '--changed-ids',
+            type=str,
+            help='file to which the ids of changed sections are written',
         )
 
     def handle(self, *args, **kwargs):
@@ -97,31 +196,195 @@ class Command(BaseCommand):
                 )
                 sys.exit()
 
-            try:
-                logger.info('Importing road sections...')
-                management.call_command(
-                    'importsections', FPATH_ROAD_SECTIONS, delete=kwargs['delete']
-                )
+            # Stages whose input files have not changed since the last
+            # successful import are skipped and their data is kept
+            files = self.changed_files(kwargs['force'])
+            import_sections = kwargs['delete'] or bool(
+                files & {FPATH_ROAD_SECTIONS, FPATH_INTERSECTIONS}
+            )
+            import_details = import_sections or FPATH_SECTION_DETAILS in files
+            import_accidents = import_sections or FPATH_SECTION_ACCIDENTS in files
+            stages = (import_sections, import_details, import_accidents)
 
-                logger.info('Importing intersections...')
-                management.call_command('importsections', FPATH_INTERSECTIONS)
-            except Exception as e:
-                logger.exception('')
-                self.stderr.write(
-                    "Error importing sections, cannot proceed with update."
+            if not any(stages):
+                logger.info('Input files have not changed, nothing to import')
+                changed = set()
+            elif kwargs['incremental']:
+                changed = self.update_incremental(stages)
+            else:
+                changed = self.update_staged(
+                    stages, kwargs['delete'], kwargs['processes']
                 )
-                sys.exit(1)
-
-            logger.info('Importing section details...')
-            management.call_command('importsectiondetails', FPATH_SECTION_DETAILS)
 
-            logger.info('Importing section accident dataset...')
-            management.call_command(
-                'importsectionaccidents', FPATH_SECTION_ACCIDENTS, '--confirm'
-            )
+            if kwargs['changed_ids']:
+                write_ids(changed, kwargs['changed_ids'])
+            self.record_imported_files()
+            logger.info(f'Data of {len(changed)} sections changed')
 
         except Exception as e:
             logger.error('Failed importing updated dataset')
             raise e
         else:
             logger.info('Update finished')
+
+    def update_staged(self, stages, delete, processes):
+        """Import into staging tables and replace the current dataset
+
+        Returns:
+            set: Ids of sections whose data changed
+        """
+        import_sections, import_details, import_accidents = stages
+        logger.info('Creating staging tables...')
+        copy = []
+        if not delete:
+            copy.append(Section)
+        if not import_details:
+            copy.append(SectionDetails)
+        if not import_accidents:
+            copy.append(SectionAccidents)
+        staging.create(copy=copy)
+
+        with staging.using():
+            self.import_files(stages, processes)
+
+        try:
+            staging.validate()
+        except staging.StagingError as e:
+            logger.error(f'Invalid dataset, update canceled: {e}')
+            sys.exit(1)
+
+        changed = staging.changed_sections()
+        if len(changed) > 0:
+            logger.info('Replacing current dataset...')
+            staging.swap()
+        else:
+            staging.drop()
+        return changed
+
+    def update_incremental(self, stages):
+        """Write changed rows to the current tables in a single transaction
+
+        Readers keep seeing the previous dataset until the transaction is
+        committed. Sections are imported in this process so that they are
+        written in the same transaction.
+
+        Returns:
+            set: Ids of sections whose data changed
+        """
+        with transaction.atomic():
+            changed = self.import_files(stages, processes=None)
+            try:
+                staging.validate('public')
+            except staging.StagingError as e:
+                logger.error(f'Invalid dataset, update canceled: {e}')
+                sys.exit(1)
+        return changed
+
+    def import_files(self, stages, processes):
+        """Run the import commands of the given stages
+
+        Parameters:
+            stages (tuple): Whether to import sections, section details and
+                section accident data
+            processes (int): Number of processes used to import each sections
+                file, `None` to import them in this process
+
+        Returns:
+            set: Ids of sections whose data changed
+        """
+        import_sections, import_details, import_accidents = stages
+        changed = set()
+        with tempfile.TemporaryDirectory() as directory:
+            if import_sections:
+                try:
+                    changed |= self.import_sections(processes, directory)
+                    changed |= self.delete_missing_sections()
+                except Exception as e:
+                    logger.exception('')
+                    self.stderr.write(
+                        "Error importing sections, cannot proceed with update."
+                    )
+                    sys.exit(1)
+
+            if import_details:
+                logger.info('Importing section details...')
+                path = os.path.join(directory, 'details')
+                management.call_command(
+                    'importsectiondetails', FPATH_SECTION_DETAILS, changed_ids=path
+                )
+                changed |= read_ids(path)
+
+            if import_accidents:
+                logger.info('Importing section accident dataset...')
+                path = os.path.join(directory, 'accidents')
+                management.call_command(
+                    'importsectionaccidents',
+                    FPATH_SECTION_ACCIDENTS,
+                    '--confirm',
+                    changed_ids=path,
+                )
+                changed |= read_ids(path)
+        return changed
+
+    def changed_files(self, force=False):
+        """Input datasets that changed since they were last imported"""
+        return changed_datasets(
+            file_etags(read_manifest()), read_manifest(FPATH_IMPORTED), force
+        )
+
+    def record_imported_files(self):
+        write_manifest(imported_files(file_etags(read_manifest())), FPATH_IMPORTED)
+
+    def import_sections(self, processes, directory):
+        """Import road sections and intersections
+
+        The files are imported concurrently in separate processes unless
+        `processes` is `None`.
+
+        Returns:
+            set: Ids of sections that were created or updated
+        """
+        logger.info('Importing road sections and intersections...')
+        paths = {
+            path: os.path.join(directory, f'sections-{i}')
+            for i, path in enumerate((FPATH_ROAD_SECTIONS, FPATH_INTERSECTIONS))
+        }
+
+        if processes is None:
+            for path, ids_path in paths.items():
+                management.call_command('importsections', path, changed_ids=ids_path)
+        else:
+            # Database connections must not be shared with forked processes
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            workers = [
+                context.Process(
+                    target=management.call_command,
+                    args=('importsections', path),
+                    kwargs={'processes': processes, 'changed_ids': ids_path},
+                )
+                for path, ids_path in paths.items()
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            failed = [w for w in workers if w.exitcode != 0]
+            if len(failed) > 0:
+                raise Exception(f'{len(failed)} section imports failed')
+
+        return set().union(*(read_ids(p) for p in paths.values()))
+
+    def delete_missing_sections(self):
+        """Delete sections that are contained in neither sections file
+
+        Returns:
+            set: Ids of the deleted sections
+        """
+        ids = set()
+        for path in (FPATH_ROAD_SECTIONS, FPATH_INTERSECTIONS):
+            ids.update(int(id) for id in DataSource(path)[0].get_fields('id'))
+        missing = set(Section.objects.values_list('id', flat=True)) - ids
+        Section.objects.filter(id__in=missing).delete()
+        return missing
@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from fixmyapp import tiles
+from fixmyapp.caching import bump_version
 from fixmyapp.models import Project
 import os
 
@@ -21,6 +23,12 @@ class Command(BaseCommand):
             dest='progress',
             help='display the progress bar in any verbosity level.',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of features saved at once, 0 to save them one by one',
+        )
 
     def handle(self, *args, **options):
         mapping = {'project_key': 'ProjectKey', 'geometry': options['type']}
@@ -38,4 +46,9 @@ class Command(BaseCommand):
             silent=options['verbosity'] == 0,
             stream=self.stdout,
             strict=False,
+            batch_size=options['batch_size'],
         )
+        # Bulk writes do not send the signals that invalidate cached tiles
+        # and project list responses
+        tiles.invalidate('projects')
+        bump_version('projects')
@@ -0,0 +1,32 @@
+"""Helpers for importing only the rows of a dataset that changed
+
+Imported rows are stored along with a hash of their values. When a dataset is
+imported again, rows whose hash matches the stored hash are skipped and only
+new, changed and removed rows are written. Import commands report the ids of
+sections whose data changed so that derived data can be updated selectively.
+"""
+import hashlib
+import json
+
+
+def row_hash(values):
+    """Return a hash of the values of an imported row
+
+    Parameters:
+        values: Values that can be serialized to JSON. Other values, e.g.
+            decimals and datetimes, are serialized as strings.
+    """
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def read_ids(path):
+    """Read ids written by `write_ids`"""
+    with open(path) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def write_ids(ids, path):
+    """Write ids to a file, one per line"""
+    with open(path, 'w') as f:
+        f.writelines(f'{id}\n' for id in sorted(ids))
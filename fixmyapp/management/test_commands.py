@@ -1,12 +1,20 @@
+import gzip
+import io
 import json
+import os
+import sqlite3
 import tempfile
-from django.core.management import call_command
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase
 from unittest.mock import patch, call
 from decimal import Decimal
+from types import SimpleNamespace
 from collections import OrderedDict
 
-from fixmyapp.models import Section, SectionAccidents
+from fixmyapp import tiles
+from fixmyapp.management.commands import updatehbi
+from fixmyapp.models import Project, Section, SectionAccidents, SectionDetails
 from fixmyapp.serializers import SectionAccidentsSerializer, SectionDetailsSerializer
 
 
@@ -46,6 +54,85 @@ Unfallatlas, Statistische Ämter des Bundes und der Länder (2019).",1,2
         }
         self.assertDictEqual(section_accidents_serialized, section_accidents_expected)
 
+    def test_skipped_rows(self):
+        """Test that rows for missing sections and duplicate sides are skipped."""
+
+        raw_section_accidents = f"""section_id,killed,severely_injured,slightly_injured,source,risk_level,side
+{self.section.id},0,1,0,Unfallatlas,1,2
+{self.section.id},1,1,0,Unfallatlas,1,2
+999999,0,1,0,Unfallatlas,1,2
+{self.section.id},0,0,0,Unfallatlas,0,0
+"""
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.csv'
+        ) as f:
+            f.write(raw_section_accidents)
+            f.seek(0)
+            with self.assertLogs(
+                'fixmyapp.management.commands.importsectionaccidents', 'WARNING'
+            ) as logs:
+                call_command(
+                    'importsectionaccidents',
+                    f.name,
+                    skip_confirmation=True,
+                    batch_size=2,
+                )
+
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('duplicate section accidents for side 2', logs.output[0])
+        self.assertIn('missing section 999999', logs.output[1])
+        self.assertEqual(
+            sorted(self.section.accidents.values_list('side', 'killed')),
+            [(0, 0), (2, 0)],
+        )
+
+    def test_changed_ids(self):
+        """Test that only changed datasets are written and reported."""
+
+        header = (
+            "section_id,killed,severely_injured,slightly_injured,source,risk_level,side"
+        )
+        other = Section.objects.exclude(pk=self.section.pk).first()
+
+        def import_rows(*rows):
+            with tempfile.NamedTemporaryFile(
+                mode="w+", encoding="UTF-8", suffix='.csv'
+            ) as f, tempfile.NamedTemporaryFile(mode="r") as ids:
+                f.write('\n'.join((header,) + rows))
+                f.seek(0)
+                call_command(
+                    'importsectionaccidents',
+                    f.name,
+                    skip_confirmation=True,
+                    changed_ids=ids.name,
+                )
+                return [int(line) for line in ids]
+
+        self.assertEqual(
+            import_rows(
+                f"{self.section.id},0,1,0,Unfallatlas,1,2",
+                f"{other.id},0,0,0,Unfallatlas,0,2",
+            ),
+            sorted([self.section.id, other.id]),
+        )
+        unchanged = other.accidents.get()
+
+        self.assertEqual(
+            import_rows(
+                f"{self.section.id},1,1,0,Unfallatlas,3,2",
+                f"{other.id},0,0,0,Unfallatlas,0,2",
+            ),
+            [self.section.id],
+        )
+        self.assertEqual(self.section.accidents.get().risk_level, 3)
+        self.assertEqual(other.accidents.get().modified_date, unchanged.modified_date)
+
+        self.assertEqual(
+            import_rows(f"{self.section.id},1,1,0,Unfallatlas,3,2"), [other.id]
+        )
+        self.assertFalse(other.accidents.exists())
+
     def test_missing_column(self):
         """Test importing dataset with a missing column."""
 
@@ -106,6 +193,14 @@ class ImportSectionDetails(TestCase):
 
         self.assertEqual(self.section.details.count(), 1)
 
+        # HBI values are stored after importing
+        self.section.refresh_from_db()
+        self.assertAlmostEqual(self.section.hbi_velocity_index, 1.0, 1)
+        self.assertAlmostEqual(self.section.hbi_safety_index, 5.3, 1)
+        self.assertAlmostEqual(
+            self.section.details.first().hbi_happy_bike_index, 6.3, 1
+        )
+
         # Mocking calls to S3 to keep this test light
         with patch('storages.backends.s3boto3.S3Boto3Storage.url') as mock_s3_url:
             mock_s3_url.return_value = 's3-url.jpg'
@@ -176,6 +271,75 @@ class ImportSectionDetails(TestCase):
         }
         self.assertDictEqual(section_details_serialized, section_details_expected)
 
+    def test_skipped_rows(self):
+        """Test that rows for missing sections and duplicate sides are skipped."""
+
+        row = "0,1,30,5110.15,40.98,521.55,4.85,874.77,1,S,0,0.00,0,0,0,0,0,0,0,0,21.94964056,0,0,1_0,/test1.jpg"
+        raw_section_details = f"""section_id,side,exist,tempolimit,dailytraffic,dailytraffic_heavy,daily_traffic_transporter,dailiy_traffic_bus,length,crossings,orientation,RVA1,RVA2,RVA3,RVA4,RVA5,RVA6,RVA7,RVA8,RVA9,RVA10,RVA11,RVA12,RVA13,hilfs,rva_pics
+{self.section.id},{row}
+{self.section.id},{row}
+999999,{row}
+"""
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.csv'
+        ) as f:
+            f.write(raw_section_details)
+            f.seek(0)
+            with self.assertLogs(
+                'fixmyapp.management.commands.importsectiondetails', 'WARNING'
+            ) as logs:
+                call_command('importsectiondetails', f.name, batch_size=2)
+
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('duplicate section detail for side 0', logs.output[0])
+        self.assertIn('missing section 999999', logs.output[1])
+        self.assertEqual(SectionDetails.objects.count(), 1)
+        self.assertEqual(self.section.details.first().photos.count(), 1)
+
+    def test_changed_ids(self):
+        """Test that only changed details are written and reported."""
+
+        header = "section_id,side,exist,tempolimit,dailytraffic,dailytraffic_heavy,daily_traffic_transporter,dailiy_traffic_bus,length,crossings,orientation,RVA1,RVA2,RVA3,RVA4,RVA5,RVA6,RVA7,RVA8,RVA9,RVA10,RVA11,RVA12,RVA13,hilfs,rva_pics"
+        row = "1,30,5110.15,40.98,521.55,4.85,874.77,1,S,0,0.00,0,0,0,0,0,0,0,0,21.94964056,0,0,1_0"
+        other = Section.objects.exclude(pk=self.section.pk).first()
+
+        def import_rows(*rows):
+            with tempfile.NamedTemporaryFile(
+                mode="w+", encoding="UTF-8", suffix='.csv'
+            ) as f, tempfile.NamedTemporaryFile(mode="r") as ids:
+                f.write('\n'.join((header,) + rows))
+                f.seek(0)
+                call_command('importsectiondetails', f.name, changed_ids=ids.name)
+                return [int(line) for line in ids]
+
+        self.assertEqual(
+            import_rows(
+                f"{self.section.id},0,{row},/test1.jpg",
+                f"{other.id},0,{row},/test1.jpg",
+            ),
+            sorted([self.section.id, other.id]),
+        )
+        unchanged = other.details.get()
+
+        self.assertEqual(
+            import_rows(
+                f"{self.section.id},0,{row},/test1.jpg /test2.jpg",
+                f"{other.id},0,{row},/test1.jpg",
+            ),
+            [self.section.id],
+        )
+        self.assertEqual(self.section.details.get().photos.count(), 2)
+        self.assertEqual(other.details.get().modified_date, unchanged.modified_date)
+
+        self.assertEqual(
+            import_rows(f"{self.section.id},0,{row},/test1.jpg /test2.jpg"),
+            [other.id],
+        )
+        self.assertFalse(other.details.exists())
+        other.refresh_from_db()
+        self.assertEqual(other.hbi_happy_bike_index, 0)
+
     def test_missing_column(self):
         """Test importing dataset with a missing column."""
 
@@ -192,6 +356,70 @@ class ImportSectionDetails(TestCase):
                 call_command('importsectiondetails', f.name)
 
 
+class ImportSectionsTest(TestCase):
+    def test_changed_ids(self):
+        """Test that unchanged sections are not written again."""
+
+        def feature(id, name):
+            return {
+                'type': 'Feature',
+                'properties': {
+                    'id': id,
+                    'name': name,
+                    'suffix': 'a',
+                    'borough': 'Mitte',
+                    'is_road': True,
+                },
+                'geometry': {
+                    'type': 'MultiLineString',
+                    'coordinates': [[[13.4, 52.5 + id / 100], [13.41, 52.5]]],
+                },
+            }
+
+        def import_features(*features, batch_size=1000):
+            with tempfile.NamedTemporaryFile(
+                mode="w+", encoding="UTF-8", suffix='.geojson'
+            ) as f, tempfile.NamedTemporaryFile(mode="r") as ids:
+                json.dump({'type': 'FeatureCollection', 'features': features}, f)
+                f.flush()
+                call_command(
+                    'importsections',
+                    f.name,
+                    changed_ids=ids.name,
+                    batch_size=batch_size,
+                    verbosity=0,
+                )
+                return [int(line) for line in ids]
+
+        self.assertEqual(
+            import_features(
+                feature(1, 'Unter den Linden'), feature(2, 'Invalidenstraße')
+            ),
+            [1, 2],
+        )
+        unchanged = Section.objects.get(pk=2)
+
+        for batch_size in (0, 1000):
+            self.assertEqual(
+                import_features(
+                    feature(1, 'Unter den Linden'),
+                    feature(2, 'Invalidenstraße'),
+                    batch_size=batch_size,
+                ),
+                [],
+            )
+        self.assertEqual(
+            import_features(
+                feature(1, 'Friedrichstraße'), feature(2, 'Invalidenstraße')
+            ),
+            [1],
+        )
+        self.assertEqual(Section.objects.get(pk=1).street_name, 'Friedrichstraße')
+        self.assertEqual(
+            Section.objects.get(pk=2).modified_date, unchanged.modified_date
+        )
+
+
 class ExportSectionTest(TestCase):
     fixtures = ['sections', 'sectionaccidents', 'sectiondetails']
 
@@ -206,3 +434,375 @@ class ExportSectionTest(TestCase):
             self.assertEqual(export.get('type'), 'FeatureCollection')
             self.assertEqual(type(export.get('features')), list)
             self.assertEqual(len(export.get('features')), 10)
+
+    def test_command_chunked(self):
+        """Test that exporting in small chunks yields every section once."""
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            # three chunks of sections, details and accidents
+            with self.assertNumQueries(3 * 3):
+                call_command('exportsections', f.name, chunk_size=4)
+            export = json.load(f)
+            ids = [feature['properties']['id'] for feature in export['features']]
+            self.assertEqual(
+                ids, list(Section.objects.order_by('pk').values_list('pk', flat=True))
+            )
+
+    def test_command_without_scores(self):
+        """Test that missing stored scores are computed on export."""
+
+        Section.objects.update(hbi_velocity_index=None, hbi_safety_index=None)
+        SectionDetails.objects.update(hbi_velocity_index=None, hbi_safety_index=None)
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            call_command('exportsections', f.name)
+            export = json.load(f)
+
+        for feature in export['features']:
+            properties = feature['properties']
+            if properties['is_road']:
+                section = Section.objects.get(pk=properties['id'])
+                self.assertEqual(
+                    properties['velocity'], round(float(section.velocity_index()), 3)
+                )
+                self.assertEqual(
+                    properties['safety'], round(float(section.safety_index()), 3)
+                )
+
+
+class ExportSectionWorkersTest(TransactionTestCase):
+    fixtures = ['sections', 'sectionaccidents', 'sectiondetails']
+
+    def test_command_workers(self):
+        """Test that a sharded export equals a single process export."""
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            call_command('exportsections', f.name)
+            expected = json.load(f)
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            call_command('exportsections', f.name, workers=3)
+            export = json.load(f)
+
+        self.assertEqual(export, expected)
+
+
+class GenerateTilesTest(TransactionTestCase):
+    fixtures = ['sections', 'sectionaccidents', 'sectiondetails']
+
+    def test_command(self):
+        """Test rendering sections into an MBTiles file."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sections.mbtiles')
+            call_command(
+                'generatetiles',
+                filename,
+                layers=['sections'],
+                min_zoom=10,
+                max_zoom=12,
+                processes=2,
+                batch_size=2,
+            )
+
+            db = sqlite3.connect(filename)
+            metadata = dict(db.execute('SELECT name, value FROM metadata'))
+            self.assertEqual(metadata['format'], 'pbf')
+            self.assertEqual(metadata['minzoom'], '10')
+            self.assertEqual(metadata['maxzoom'], '12')
+
+            zoom_levels = [
+                row[0]
+                for row in db.execute(
+                    'SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level'
+                )
+            ]
+            self.assertEqual(zoom_levels, [10, 11, 12])
+
+            # Tile 12/2200/1343 contains section 2725
+            (data,) = db.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = 12 '
+                'AND tile_column = 2200 AND tile_row = 4095 - 1343'
+            ).fetchone()
+            self.assertIn(b'sections', gzip.decompress(data))
+            for (data,) in db.execute('SELECT tile_data FROM tiles'):
+                self.assertGreater(len(gzip.decompress(data)), 0)
+            db.close()
+
+    def test_empty_parent_tiles(self):
+        """Test that children of empty tiles with features are rendered."""
+
+        render = tiles.Layer.render
+
+        def render_above_zoom_11(layer, z, x, y):
+            return render(layer, z, x, y) if z > 11 else b''
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sections.mbtiles')
+            with patch.object(tiles.Layer, 'render', render_above_zoom_11):
+                call_command(
+                    'generatetiles',
+                    filename,
+                    layers=['sections'],
+                    min_zoom=10,
+                    max_zoom=12,
+                    processes=2,
+                )
+
+            db = sqlite3.connect(filename)
+            zoom_levels = [
+                row[0]
+                for row in db.execute(
+                    'SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level'
+                )
+            ]
+            self.assertEqual(zoom_levels, [12])
+            db.close()
+
+
+class BenchmarkProjectsTest(TestCase):
+    fixtures = ['projects']
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('benchmarkprojects', repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('GEOS: '))
+        self.assertTrue(lines[1].startswith('database: '))
+
+
+class UpdateProjectGeometriesTest(TestCase):
+    fixtures = ['projects']
+
+    def test_command(self):
+        """Test updating project geometries in batches and one by one."""
+
+        features = [
+            {
+                'type': 'Feature',
+                'properties': {'ProjectKey': key},
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': [[13.4, 52.5 + i / 100], [13.41, 52.5 + i / 100]],
+                },
+            }
+            for i, key in enumerate(['FK-020', 'FK-003'])
+        ]
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+            f.flush()
+
+            for batch_size in (0, 1000):
+                Project.objects.update(geometry=None)
+                call_command(
+                    'updateprojectgeometries',
+                    f.name,
+                    'linestring',
+                    batch_size=batch_size,
+                    verbosity=0,
+                )
+
+                self.assertEqual(Project.objects.count(), 4)
+                self.assertEqual(
+                    sorted(
+                        Project.objects.filter(geometry__isnull=False).values_list(
+                            'project_key', flat=True
+                        )
+                    ),
+                    ['FK-003', 'FK-020'],
+                )
+                self.assertAlmostEqual(
+                    Project.objects.get(project_key='FK-003').geometry.coords[0][1],
+                    52.51,
+                )
+
+    def test_project_list(self):
+        """Test that the project list shows updated geometries immediately."""
+
+        cache.clear()
+        response = self.client.get('/api/projects')
+        self.assertIsNone(
+            {p['project_key']: p for p in response.json()['results']}['FK-003'][
+                'center'
+            ]
+        )
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+", encoding="UTF-8", suffix='.geojson'
+        ) as f:
+            json.dump(
+                {
+                    'type': 'FeatureCollection',
+                    'features': [
+                        {
+                            'type': 'Feature',
+                            'properties': {'ProjectKey': 'FK-003'},
+                            'geometry': {
+                                'type': 'LineString',
+                                'coordinates': [[13.4, 52.5], [13.41, 52.5]],
+                            },
+                        }
+                    ],
+                },
+                f,
+            )
+            f.flush()
+            call_command('updateprojectgeometries', f.name, 'linestring', verbosity=0)
+
+        response = self.client.get('/api/projects')
+        project = {p['project_key']: p for p in response.json()['results']}['FK-003']
+        self.assertIsNotNone(project['center'])
+        self.assertIsNotNone(project['geometry'])
+
+
+class FakeBucket:
+    """Stand-in for an S3 bucket resource holding objects in memory"""
+
+    def __init__(self, contents):
+        self.name = 'bucket'
+        self.contents = contents
+        self.downloads = []
+        self.failing = set()
+        self.objects = self
+        self.meta = SimpleNamespace(client=self)
+
+    def filter(self, Prefix):
+        return [
+            SimpleNamespace(key=key, e_tag=f'"{hash(data)}"', size=len(data))
+            for key, data in self.contents.items()
+            if key.startswith(Prefix)
+        ]
+
+    def download_file(self, bucket, key, filename, Config=None):
+        if key in self.failing:
+            raise IOError(f'Download of {key} failed')
+        self.downloads.append(key)
+        with open(filename, 'wb') as f:
+            f.write(self.contents[key])
+
+
+class DownloadFilesTest(TestCase):
+    def test_command(self):
+        """Test that only new and changed files are downloaded."""
+
+        bucket = FakeBucket(
+            {
+                'Data/a.csv': b'a',
+                'Data/b.csv': b'b',
+                'Data/sub/c.csv': b'c',
+                'Other/d.csv': b'd',
+            }
+        )
+
+        with tempfile.TemporaryDirectory() as directory, patch(
+            'fixmyapp.management.commands.downloadfiles.default_storage',
+            SimpleNamespace(bucket=bucket),
+        ):
+            manifest = os.path.join(directory, 'manifest.json')
+
+            def download():
+                bucket.downloads = []
+                call_command(
+                    'downloadfiles',
+                    'Data',
+                    target=directory,
+                    manifest=manifest,
+                    verbosity=0,
+                )
+                return sorted(bucket.downloads)
+
+            self.assertEqual(download(), ['Data/a.csv', 'Data/b.csv'])
+            with open(os.path.join(directory, 'a.csv'), 'rb') as f:
+                self.assertEqual(f.read(), b'a')
+
+            self.assertEqual(download(), [])
+
+            bucket.contents['Data/b.csv'] = b'bb'
+            os.remove(os.path.join(directory, 'a.csv'))
+            self.assertEqual(download(), ['Data/a.csv', 'Data/b.csv'])
+
+            with open(manifest) as f:
+                entry = json.load(f)['Data/b.csv']
+            self.assertEqual(entry['size'], 2)
+            self.assertEqual(entry['path'], os.path.join(directory, 'b.csv'))
+
+        with patch(
+            'fixmyapp.management.commands.downloadfiles.default_storage',
+            SimpleNamespace(bucket=FakeBucket({})),
+        ):
+            with self.assertRaises(CommandError):
+                call_command('downloadfiles', 'Data')
+
+    def test_failed_download(self):
+        """Test that files downloaded besides a failed download are recorded."""
+        bucket = FakeBucket({f'Data/{name}.csv': name.encode() for name in 'abcd'})
+        bucket.failing.add('Data/a.csv')
+
+        with tempfile.TemporaryDirectory() as directory, patch(
+            'fixmyapp.management.commands.downloadfiles.default_storage',
+            SimpleNamespace(bucket=bucket),
+        ):
+            manifest = os.path.join(directory, 'manifest.json')
+            with self.assertRaises(CommandError):
+                call_command(
+                    'downloadfiles',
+                    'Data',
+                    target=directory,
+                    manifest=manifest,
+                    workers=1,
+                    verbosity=0,
+                )
+            with open(manifest) as f:
+                self.assertEqual(
+                    sorted(json.load(f)), ['Data/b.csv', 'Data/c.csv', 'Data/d.csv']
+                )
+
+
+class UpdateHBIChangedFilesTest(TestCase):
+    def setUp(self):
+        self.downloaded = {
+            f: f'"{f}"'
+            for path in updatehbi.INPUT_FILES
+            for f in updatehbi.dataset_files(path)
+            if not f.endswith('.cpg')
+        }
+
+    def test_unchanged(self):
+        imported = updatehbi.imported_files(self.downloaded)
+        self.assertEqual(updatehbi.changed_datasets(self.downloaded, imported), set())
+        self.assertEqual(
+            updatehbi.changed_datasets(self.downloaded, imported, force=True),
+            set(updatehbi.INPUT_FILES),
+        )
+
+    def test_changed_attributes(self):
+        """Test that changes of the attributes of a shapefile are detected."""
+        imported = updatehbi.imported_files(self.downloaded)
+        self.downloaded['/tmp/road_sections-v1.1.dbf'] = '"changed"'
+        self.assertEqual(
+            updatehbi.changed_datasets(self.downloaded, imported),
+            {updatehbi.FPATH_ROAD_SECTIONS},
+        )
+
+    def test_first_import(self):
+        self.assertEqual(
+            updatehbi.changed_datasets(self.downloaded, {}),
+            set(updatehbi.INPUT_FILES),
+        )
+        del self.downloaded[updatehbi.FPATH_SECTION_DETAILS]
+        imported = updatehbi.imported_files(self.downloaded)
+        self.assertEqual(
+            updatehbi.changed_datasets(self.downloaded, imported),
+            {updatehbi.FPATH_SECTION_DETAILS},
+        )
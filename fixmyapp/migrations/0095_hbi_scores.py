@@ -0,0 +1,269 @@
+# Generated by Django 4.0.7 on 2026-10-18 10:00
+
+import numpy
+from django.db import migrations, models
+
+# The HBI computation of `fixmyapp.hbi` at the time of this migration, frozen
+# so that later changes to it do not affect this migration
+FIELDS = (
+    'speed_limit',
+    'daily_traffic',
+    'length',
+    'crossings',
+    'rva1',
+    'rva2',
+    'rva3',
+    'rva4',
+    'rva5',
+    'rva6',
+    'rva7',
+    'rva8',
+    'rva9',
+    'rva10',
+    'rva11',
+    'rva12',
+    'rva13',
+)
+SECTION_INDICES = ('happy_bike_index', 'safety_index', 'velocity_index')
+AVG_WIDTH_CROSSINGS = 6
+CI_RATIO_MIN = 0.65
+CI_CATEGORY_RATIO_MIN = 0.1
+ROAD_TYPE_SPEED_LIMITS = (20, 30, 40, 50, 60)
+ROAD_TYPE_THRESHOLDS = (
+    (11000, 18000, 20000),
+    (8000, 18000, 20000),
+    (6000, 16000, 19000),
+    (4000, 10000, 18000),
+    (2000, 5000, 7000),
+    (2000, 3000, 6000),
+)
+# fmt: off
+VELOCITY_WEIGHTS = numpy.array([0, 0, 2, 1, 0, 0, 2, 3, 3, 3, 2, 3, 2], dtype=float)
+SAFETY_WEIGHTS = numpy.array([0, 0, 3, 3, 3, 3, 2, 3, 3, 3, 1, 1, 1], dtype=float)
+CATEGORIES = {
+    'advisory_bike_lane_ratio': [10, 11, 12],
+    'bike_lane_ratio': [6],
+    'bike_path_ratio': [2, 3, 9],
+    'protected_bike_lane_ratio': [7, 8],
+    'shared_use_path_ratio': [4, 5],
+}
+CYCLING_INFRASTRUCTURE = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+# fmt: on
+
+
+def _divide(dividend, divisor):
+    return numpy.divide(
+        dividend, divisor, out=numpy.zeros_like(dividend), where=divisor != 0
+    )
+
+
+def compute(data):
+    speed_limit, daily_traffic, length, crossings = data[:, :4].T
+    rva = data[:, 4:]
+    length_without_crossings = length - AVG_WIDTH_CROSSINGS * crossings
+    ci_sum = rva[:, CYCLING_INFRASTRUCTURE].sum(axis=1)
+    ci_ratio = _divide(ci_sum, length_without_crossings)
+    below_ci_ratio_min = ci_ratio < CI_RATIO_MIN
+
+    velocity_sum = rva @ VELOCITY_WEIGHTS
+    ci_factor = numpy.where(
+        ci_sum > 0, _divide(velocity_sum, ci_sum * 3), velocity_sum / 3
+    )
+    velocity_index = numpy.where(
+        below_ci_ratio_min, ci_ratio * ci_factor + (1 - ci_ratio), ci_factor
+    )
+    ci_safety = numpy.where(
+        below_ci_ratio_min, 0.0, _divide(rva @ SAFETY_WEIGHTS, ci_sum)
+    )
+
+    bins = numpy.searchsorted(ROAD_TYPE_SPEED_LIMITS, speed_limit, side='left')
+    l0, l1, l2 = numpy.array(ROAD_TYPE_THRESHOLDS, dtype=float)[bins].T
+    road_type = numpy.select(
+        [daily_traffic <= l0, daily_traffic <= l1, daily_traffic <= l2],
+        [
+            daily_traffic / l0,
+            1 + (daily_traffic - l0) / (l1 - l0),
+            2 + (daily_traffic - l1) / (l2 - l1),
+        ],
+        default=3,
+    )
+    safety_index = 2.25 * numpy.where(
+        ci_safety <= road_type,
+        3 + ci_safety - road_type,
+        3 + (ci_safety - road_type) / 3,
+    )
+
+    results = {
+        name: numpy.where(
+            ci_ratio < CI_CATEGORY_RATIO_MIN,
+            0.0,
+            _divide(rva[:, category].sum(axis=1), length_without_crossings),
+        )
+        for name, category in CATEGORIES.items()
+    }
+    results.update(
+        cycling_infrastructure_ratio=ci_ratio,
+        cycling_infrastructure_safety=ci_safety,
+        happy_bike_index=velocity_index + safety_index,
+        road_type=road_type,
+        safety_index=safety_index,
+        velocity_index=velocity_index,
+    )
+    return results
+
+
+def update_scores(apps, schema_editor):
+    Section = apps.get_model('fixmyapp', 'Section')
+    SectionDetails = apps.get_model('fixmyapp', 'SectionDetails')
+
+    rows = list(
+        SectionDetails.objects.order_by().values_list('pk', 'section_id', *FIELDS)
+    )
+    if len(rows) > 0:
+        data = numpy.array(rows, dtype=float)
+        pks, section_ids = data[:, 0].astype(int), data[:, 1].astype(int)
+        results = compute(data[:, 2:])
+        SectionDetails.objects.bulk_update(
+            [
+                SectionDetails(
+                    pk=int(pk),
+                    **{f'hbi_{k}': float(v[i]) for k, v in results.items()},
+                )
+                for i, pk in enumerate(pks)
+            ],
+            [f'hbi_{name}' for name in results],
+            batch_size=1000,
+        )
+
+        ids, inverse, counts = numpy.unique(
+            section_ids, return_inverse=True, return_counts=True
+        )
+        averages = {
+            name: numpy.bincount(inverse, weights=results[name]) / counts
+            for name in SECTION_INDICES
+        }
+        Section.objects.bulk_update(
+            [
+                Section(
+                    pk=int(id),
+                    **{f'hbi_{k}': float(v[i]) for k, v in averages.items()},
+                )
+                for i, id in enumerate(ids)
+            ],
+            [f'hbi_{name}' for name in SECTION_INDICES],
+            batch_size=1000,
+        )
+
+    # Sections without details have zero scores, see `Section.velocity_index`
+    Section.objects.filter(details__isnull=True).update(
+        **{f'hbi_{name}': 0 for name in SECTION_INDICES}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0094_alter_gastrosignup_campaign'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='hbi_happy_bike_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='happy bike index'
+            ),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='hbi_safety_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='safety index'
+            ),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='hbi_velocity_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='velocity index'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_advisory_bike_lane_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='advisory bike lane ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_bike_lane_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='bike lane ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_bike_path_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='bike path ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_cycling_infrastructure_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='cycling infrastructure ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_cycling_infrastructure_safety',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='cycling infrastructure safety'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_happy_bike_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='happy bike index'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_protected_bike_lane_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='protected bike lane ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_road_type',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='road type'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_safety_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='safety index'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_shared_use_path_ratio',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='shared use path ratio'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='hbi_velocity_index',
+            field=models.FloatField(
+                editable=False, null=True, verbose_name='velocity index'
+            ),
+        ),
+        migrations.RunPython(update_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.0.7 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0095_hbi_scores'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='section',
+            name='borough',
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=255,
+                null=True,
+                verbose_name='borough',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='section',
+            name='hbi_happy_bike_index',
+            field=models.FloatField(
+                db_index=True,
+                editable=False,
+                null=True,
+                verbose_name='happy bike index',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='section',
+            name='hbi_safety_index',
+            field=models.FloatField(
+                db_index=True, editable=False, null=True, verbose_name='safety index'
+            ),
+        ),
+        migrations.AlterField(
+            model_name='section',
+            name='hbi_velocity_index',
+            field=models.FloatField(
+                db_index=True, editable=False, null=True, verbose_name='velocity index'
+            ),
+        ),
+    ]
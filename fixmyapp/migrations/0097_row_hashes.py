@@ -0,0 +1,34 @@
+# Generated by Django 4.0.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0096_section_hbi_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='row_hash',
+            field=models.CharField(
+                editable=False, max_length=32, null=True, verbose_name='row hash'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectionaccidents',
+            name='row_hash',
+            field=models.CharField(
+                editable=False, max_length=32, null=True, verbose_name='row hash'
+            ),
+        ),
+        migrations.AddField(
+            model_name='sectiondetails',
+            name='row_hash',
+            field=models.CharField(
+                editable=False, max_length=32, null=True, verbose_name='row hash'
+            ),
+        ),
+    ]
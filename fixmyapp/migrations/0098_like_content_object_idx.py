@@ -0,0 +1,19 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0097_row_hashes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(
+                fields=['content_type', 'object_id'], name='like_content_object_idx'
+            ),
+        ),
+    ]
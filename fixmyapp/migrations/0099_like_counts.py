@@ -0,0 +1,66 @@
+# Generated by Django 4.0.7 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicate_likes(apps, schema_editor):
+    """Keep only the first like of each user for each object"""
+    Like = apps.get_model('fixmyapp', 'Like')
+    first_likes = (
+        Like.objects.values('content_type', 'object_id', 'user')
+        .annotate(first_id=Min('id'))
+        .values('first_id')
+    )
+    Like.objects.exclude(id__in=first_likes).delete()
+
+
+def count_likes(apps, schema_editor):
+    Like = apps.get_model('fixmyapp', 'Like')
+    Project = apps.get_model('fixmyapp', 'Project')
+    likes = (
+        Like.objects.filter(
+            content_type__app_label='fixmyapp',
+            content_type__model='project',
+            object_id=OuterRef('pk'),
+        )
+        .order_by()
+        .values('object_id')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    Project.objects.update(
+        like_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('fixmyapp', '0098_like_content_object_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(
+                fields=('content_type', 'object_id', 'user'), name='unique_like'
+            ),
+        ),
+        # The index of the unique constraint starts with the same columns
+        migrations.RemoveIndex(
+            model_name='like',
+            name='like_content_object_idx',
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='like_count',
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name='likes'
+            ),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
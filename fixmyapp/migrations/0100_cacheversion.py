@@ -0,0 +1,35 @@
+# Generated by Django 4.0.7 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0099_like_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                (
+                    'name',
+                    models.CharField(
+                        max_length=100,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='name',
+                    ),
+                ),
+                (
+                    'version',
+                    models.PositiveBigIntegerField(default=0, verbose_name='version'),
+                ),
+            ],
+            options={
+                'verbose_name': 'cache version',
+                'verbose_name_plural': 'cache versions',
+            },
+        ),
+    ]
@@ -1,8 +1,9 @@
 # fmt: off
 from .base_model import BaseModel
 from .bike_stands import BikeStands
+from .cache_version import CacheVersion
 from .gastro_signup import GastroSignup, get_upload_path
-from .like import Like
+from .like import Like, liked_object_ids
 from .notice_setting import NoticeSetting
 from .photo import Photo
 from .playstreet_signup import PlaystreetSignup
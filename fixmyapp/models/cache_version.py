@@ -0,0 +1,21 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class CacheVersion(models.Model):
+    """The current version of a dataset whose derived data is cached
+
+    Versions are stored in the database, so that changes made by any web
+    worker or management command are seen by all processes, see
+    `fixmyapp.caching`.
+    """
+
+    name = models.CharField(_('name'), max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(_('version'), default=0)
+
+    class Meta:
+        verbose_name = _('cache version')
+        verbose_name_plural = _('cache versions')
+
+    def __str__(self):
+        return f'{self.name} ({self.version})'
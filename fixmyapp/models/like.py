@@ -11,3 +11,31 @@ class Like(BaseModel):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'user'], name='unique_like'
+            )
+        ]
+
+
+def liked_object_ids(user, model, object_ids=None):
+    """Return the ids of the instances of a model liked by a user
+
+    Parameters:
+        user: The user, anonymous users have not liked anything
+        model: The model of the liked objects
+        object_ids (list): Limit the result to these ids
+
+    Returns:
+        set: The ids, retrieved with a single query
+    """
+    if not user.is_authenticated:
+        return set()
+    likes = Like.objects.filter(
+        content_type=ContentType.objects.get_for_model(model), user=user
+    )
+    if object_ids is not None:
+        likes = likes.filter(object_id__in=object_ids)
+    return set(likes.values_list('object_id', flat=True))
@@ -1,5 +1,7 @@
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import PointOnSurface, Transform
+from django.db.models import FloatField, Func
 from django.utils.translation import gettext_lazy as _
 from markdownx.models import MarkdownxField
 
@@ -9,6 +11,24 @@ from .photo import Photo
 from .question import Question
 
 
+class ProjectQuerySet(models.QuerySet):
+    def with_measures(self):
+        """Annotate the center and length of each project's geometry
+
+        The values are computed by the database and available as `db_center`
+        and `db_length`, they equal the results of the `center` and `length`
+        methods, which compute them using GEOS.
+        """
+        return self.annotate(
+            db_center=PointOnSurface('geometry'),
+            db_length=Func(
+                Transform('geometry', self.model.TRANSFORM_EPSG_3035),
+                function='ST_Length',
+                output_field=FloatField(),
+            ),
+        )
+
+
 class Project(BaseModel):
     CATEGORY_NEW_INFRASTRUCTURE = 'new cycling infrastructure'
     CATEGORY_RENOVATION = 'renovation of cycling infrastructure'
@@ -140,6 +160,10 @@ class Project(BaseModel):
     faq = models.ManyToManyField(Question, verbose_name=_('faq'), blank=True)
     photos = GenericRelation(Photo)
     likes = GenericRelation(Like)
+    # Number of likes, maintained by `fixmyapp.signals.update_like_count`
+    like_count = models.PositiveIntegerField(_('likes'), default=0, editable=False)
+
+    objects = ProjectQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('project')
@@ -7,28 +7,44 @@ from .base_model import BaseModel
 class Section(BaseModel):
     street_name = models.CharField(_('street name'), max_length=255)
     suffix = models.CharField(_('suffix'), blank=True, null=True, max_length=3)
-    borough = models.CharField(_('borough'), blank=True, null=True, max_length=255)
+    borough = models.CharField(
+        _('borough'), blank=True, null=True, max_length=255, db_index=True
+    )
     street_category = models.PositiveSmallIntegerField(_('street category'), null=True)
     geometry = models.MultiLineStringField(_('geometry'), srid=4326, null=True)
     is_road = models.BooleanField(_('is road section'), default=True)
 
+    # Averages of the HBI values stored on this section's details, see
+    # `fixmyapp.hbi.update_scores`. These are indexed for filtering and
+    # ordering the sections API.
+    hbi_happy_bike_index = models.FloatField(
+        _('happy bike index'), null=True, editable=False, db_index=True
+    )
+    hbi_safety_index = models.FloatField(
+        _('safety index'), null=True, editable=False, db_index=True
+    )
+    hbi_velocity_index = models.FloatField(
+        _('velocity index'), null=True, editable=False, db_index=True
+    )
+
+    # Hash of the imported feature, see `fixmyapp.management.diff`
+    row_hash = models.CharField(_('row hash'), max_length=32, null=True, editable=False)
+
     class Meta:
         verbose_name = _('section')
         verbose_name_plural = _('sections')
 
     def velocity_index(self):
-        if len(self.details.all()) > 0:
-            return sum(d.velocity_index() for d in self.details.all()) / len(
-                self.details.all()
-            )
+        details = self.details.all()
+        if len(details) > 0:
+            return sum(d.velocity_index() for d in details) / len(details)
         else:
             return 0
 
     def safety_index(self):
-        if len(self.details.all()) > 0:
-            return sum(d.safety_index() for d in self.details.all()) / len(
-                self.details.all()
-            )
+        details = self.details.all()
+        if len(details) > 0:
+            return sum(d.safety_index() for d in details) / len(details)
         else:
             return 0
 
@@ -33,6 +33,9 @@ class SectionAccidents(BaseModel):
         _('risk level'), choices=RISK_LEVEL_CHOICES
     )
 
+    # Hash of the imported row, see `fixmyapp.management.diff`
+    row_hash = models.CharField(_('row hash'), max_length=32, null=True, editable=False)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
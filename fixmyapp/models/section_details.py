@@ -24,6 +24,20 @@ class SectionDetails(BaseModel):
     )
     AVG_WIDTH_CROSSINGS = 6
     CI_RATIO_MIN = 0.65
+    CI_CATEGORY_RATIO_MIN = 0.1
+
+    # Daily traffic thresholds between road types 0-1, 1-2 and 2-3 for
+    # sections with a speed limit up to the given value, the last row applies
+    # to all higher speed limits
+    ROAD_TYPE_SPEED_LIMITS = (20, 30, 40, 50, 60)
+    ROAD_TYPE_THRESHOLDS = (
+        (11000, 18000, 20000),
+        (8000, 18000, 20000),
+        (6000, 16000, 19000),
+        (4000, 10000, 18000),
+        (2000, 5000, 7000),
+        (2000, 3000, 6000),
+    )
 
     section = models.ForeignKey(
         Section, related_name='details', on_delete=models.CASCADE
@@ -62,6 +76,41 @@ class SectionDetails(BaseModel):
     rva13 = models.DecimalField(max_digits=16, decimal_places=12)
     photos = GenericRelation(Photo)
 
+    # HBI values are stored when importing data so that they don't need to be
+    # computed on every request, see `fixmyapp.hbi.update_scores`
+    hbi_advisory_bike_lane_ratio = models.FloatField(
+        _('advisory bike lane ratio'), null=True, editable=False
+    )
+    hbi_bike_lane_ratio = models.FloatField(
+        _('bike lane ratio'), null=True, editable=False
+    )
+    hbi_bike_path_ratio = models.FloatField(
+        _('bike path ratio'), null=True, editable=False
+    )
+    hbi_cycling_infrastructure_ratio = models.FloatField(
+        _('cycling infrastructure ratio'), null=True, editable=False
+    )
+    hbi_cycling_infrastructure_safety = models.FloatField(
+        _('cycling infrastructure safety'), null=True, editable=False
+    )
+    hbi_happy_bike_index = models.FloatField(
+        _('happy bike index'), null=True, editable=False
+    )
+    hbi_protected_bike_lane_ratio = models.FloatField(
+        _('protected bike lane ratio'), null=True, editable=False
+    )
+    hbi_road_type = models.FloatField(_('road type'), null=True, editable=False)
+    hbi_safety_index = models.FloatField(_('safety index'), null=True, editable=False)
+    hbi_shared_use_path_ratio = models.FloatField(
+        _('shared use path ratio'), null=True, editable=False
+    )
+    hbi_velocity_index = models.FloatField(
+        _('velocity index'), null=True, editable=False
+    )
+
+    # Hash of the imported row, see `fixmyapp.management.diff`
+    row_hash = models.CharField(_('row hash'), max_length=32, null=True, editable=False)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -211,18 +260,13 @@ class SectionDetails(BaseModel):
     def road_type(self):
         """Returns a number categorizing traffic intensity"""
 
-        if self.speed_limit <= 20:
-            l = (11000, 18000, 20000)
-        elif self.speed_limit <= 30:
-            l = (8000, 18000, 20000)
-        elif self.speed_limit <= 40:
-            l = (6000, 16000, 19000)
-        elif self.speed_limit <= 50:
-            l = (4000, 10000, 18000)
-        elif self.speed_limit <= 60:
-            l = (2000, 5000, 7000)
-        else:
-            l = (2000, 3000, 6000)
+        l = self.ROAD_TYPE_THRESHOLDS[-1]
+        for speed_limit, thresholds in zip(
+            self.ROAD_TYPE_SPEED_LIMITS, self.ROAD_TYPE_THRESHOLDS
+        ):
+            if self.speed_limit <= speed_limit:
+                l = thresholds
+                break
 
         if self.daily_traffic <= l[0]:
             return self.daily_traffic / l[0]
@@ -256,7 +300,7 @@ class SectionDetails(BaseModel):
         return safety
 
     def _ci_category_ratio(self, category_sum):
-        if self.cycling_infrastructure_ratio() < 0.1:
+        if self.cycling_infrastructure_ratio() < self.CI_CATEGORY_RATIO_MIN:
             ratio = 0.0
         else:
             ratio = category_sum / self.length_without_crossings()
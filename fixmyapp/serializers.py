@@ -7,6 +7,7 @@ from drf_extra_fields.fields import HybridImageField
 from rest_framework import serializers
 from rest_framework_gis.fields import GeometryField
 
+from . import hbi
 from .models import (
     GastroSignup,
     Photo,
@@ -65,12 +66,13 @@ class ProjectSerializer(serializers.HyperlinkedModelSerializer):
     faq = QuestionSerializer(many=True)
     photos = PhotoSerializer(many=True, default=[Photo(**PLACEHOLDER_PHOTO)])
     geometry = GeometryField(precision=14)
-    center = GeometryField(precision=14)
-    length = serializers.DecimalField(None, 0)
+    # annotated by `ProjectQuerySet.with_measures`
+    center = GeometryField(precision=14, source='db_center')
+    length = serializers.DecimalField(None, 0, source='db_length')
     likes = serializers.SerializerMethodField()
 
     def get_likes(self, obj):
-        return len(obj.likes.all())
+        return obj.like_count
 
     class Meta:
         model = Project
@@ -116,20 +118,37 @@ class SectionAccidentsSerializer(serializers.ModelSerializer):
         ]
 
 
+class HBIField(serializers.DecimalField):
+    """Represents an HBI index of a section details dataset
+
+    The value stored by `fixmyapp.hbi.update_scores` is used if available.
+    Otherwise the index is computed using the model method of the same name.
+    """
+
+    def __init__(self, decimal_places, **kwargs):
+        super().__init__(None, decimal_places, **kwargs)
+
+    def get_attribute(self, instance):
+        stored = getattr(instance, hbi.SCORE_FIELD_PREFIX + self.source)
+        if stored is not None:
+            return stored
+        return super().get_attribute(instance)
+
+
 class SectionDetailsSerializer(serializers.ModelSerializer):
-    advisory_bike_lane_ratio = serializers.DecimalField(None, 3)
-    bike_lane_ratio = serializers.DecimalField(None, 3)
-    bike_path_ratio = serializers.DecimalField(None, 3)
-    cycling_infrastructure_ratio = serializers.DecimalField(None, 3)
-    cycling_infrastructure_safety = serializers.DecimalField(None, 1)
-    happy_bike_index = serializers.DecimalField(None, 1)
+    advisory_bike_lane_ratio = HBIField(3)
+    bike_lane_ratio = HBIField(3)
+    bike_path_ratio = HBIField(3)
+    cycling_infrastructure_ratio = HBIField(3)
+    cycling_infrastructure_safety = HBIField(1)
+    happy_bike_index = HBIField(1)
     length = serializers.DecimalField(None, 2)
     photos = PhotoSerializer(many=True, default=[Photo(**ANOTHER_PLACEHOLDER_PHOTO)])
-    protected_bike_lane_ratio = serializers.DecimalField(None, 3)
-    road_type = serializers.DecimalField(None, 1)
-    safety_index = serializers.DecimalField(None, 1)
-    shared_use_path_ratio = serializers.DecimalField(None, 3)
-    velocity_index = serializers.DecimalField(None, 1)
+    protected_bike_lane_ratio = HBIField(3)
+    road_type = HBIField(1)
+    safety_index = HBIField(1)
+    shared_use_path_ratio = HBIField(3)
+    velocity_index = HBIField(1)
 
     class Meta:
         model = SectionDetails
@@ -171,10 +190,28 @@ class SectionDetailsSerializer(serializers.ModelSerializer):
         )
 
 
+class SimplifiedGeometryField(GeometryField):
+    """Serializes a section's geometry simplified by `SectionList`"""
+
+    def get_attribute(self, instance):
+        if hasattr(instance, 'simplified_geometry'):
+            return instance.simplified_geometry
+        return super().get_attribute(instance)
+
+
 class SectionSerializer(serializers.HyperlinkedModelSerializer):
-    geometry = GeometryField(precision=14)
+    geometry = SimplifiedGeometryField(precision=14)
     details = SectionDetailsSerializer(many=True)
     accidents = SectionAccidentsSerializer(many=True)
+    happy_bike_index = serializers.DecimalField(
+        None, 1, source='hbi_happy_bike_index', read_only=True
+    )
+    safety_index = serializers.DecimalField(
+        None, 1, source='hbi_safety_index', read_only=True
+    )
+    velocity_index = serializers.DecimalField(
+        None, 1, source='hbi_velocity_index', read_only=True
+    )
 
     class Meta:
         model = Section
@@ -183,11 +220,14 @@ class SectionSerializer(serializers.HyperlinkedModelSerializer):
             'borough',
             'details',
             'geometry',
+            'happy_bike_index',
             'is_road',
+            'safety_index',
             'street_category',
             'street_name',
             'suffix',
             'url',
+            'velocity_index',
         )
 
 
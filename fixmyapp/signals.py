@@ -6,6 +6,46 @@ import requests
 logger = logging.getLogger(__name__)
 
 
+def invalidate_projects(sender, instance, **kwargs):
+    """Discard cached project responses when a project or its related data
+    changes
+
+    Photos and likes of other objects are ignored.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from .caching import bump_version
+    from .models import Project
+
+    content_type_id = getattr(instance, 'content_type_id', None)
+    if content_type_id not in (None, ContentType.objects.get_for_model(Project).pk):
+        return
+    bump_version('projects')
+
+
+def update_like_count(sender, instance, signal, created=False, **kwargs):
+    """Update the like counter of the liked object
+
+    Connected to `post_save` and `post_delete` of likes, so that the counter
+    is updated in the same transaction as the like. Objects without a
+    `like_count` field are ignored.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django.core.exceptions import FieldDoesNotExist
+    from django.db.models import F
+    from django.db.models.signals import post_save
+
+    if signal is post_save and not created:
+        return
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    try:
+        model._meta.get_field('like_count')
+    except FieldDoesNotExist:
+        return
+    model._base_manager.filter(pk=instance.object_id).update(
+        like_count=F('like_count') + (1 if created else -1)
+    )
+
+
 def sign_up_newsletter_on_activation(sender, **kwargs):
     if kwargs['request'].data.get('newsletter', False):
         try:
@@ -0,0 +1,231 @@
+"""Staging tables for replacing the HBI dataset without downtime
+
+A new dataset is imported into tables in a separate schema, which is put first
+on the database search path while importing so that the unchanged import
+commands write to it. After validation, the live tables are replaced by moving
+the staged tables into the `public` schema in a single short transaction,
+which does not copy any rows. Until that transaction commits, readers keep
+seeing the complete previous dataset. Photos are shared with other models, so
+only the photos of section details are copied.
+"""
+from contextlib import contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from . import tiles
+from .models import Photo, Section, SectionAccidents, SectionDetails
+
+SCHEMA = 'hbi_staging'
+
+# Schema that the replaced tables are moved to before they are dropped
+PREVIOUS_SCHEMA = 'hbi_previous'
+
+# Models whose tables are staged, in the order in which they are copied
+MODELS = (Section, SectionDetails, SectionAccidents, Photo)
+
+
+class StagingError(Exception):
+    """The staged dataset is incomplete or invalid."""
+
+    pass
+
+
+def _table(model, schema='public'):
+    qn = connection.ops.quote_name
+    return f'{qn(schema)}.{qn(model._meta.db_table)}'
+
+
+def _foreign_key(cursor, model):
+    """Name of the foreign key from a live table to the sections table"""
+    cursor.execute(
+        'SELECT conname FROM pg_constraint WHERE contype = %s '
+        'AND conrelid = %s::regclass AND confrelid = %s::regclass',
+        ['f', _table(model), _table(Section)],
+    )
+    return cursor.fetchone()[0]
+
+
+def _indexes(cursor, table):
+    """Map the definitions of the indexes of a table to their names"""
+    cursor.execute(
+        'SELECT i.indisunique, '
+        "regexp_replace(pg_get_indexdef(i.indexrelid), '^.* USING ', ''), "
+        'c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE i.indrelid = %s::regclass',
+        [table],
+    )
+    return {(unique, definition): name for unique, definition, name in cursor}
+
+
+def create(copy=()):
+    """Create empty staging tables, replacing existing ones
+
+    Parameters:
+        copy (tuple): Models among `Section`, `SectionDetails` and
+            `SectionAccidents` whose live data is copied to the staging tables,
+            e.g. because it is not imported again. The photos of section
+            details are copied along with them.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+        for model in MODELS:
+            cursor.execute(
+                f'CREATE TABLE {_table(model, SCHEMA)} '
+                f'(LIKE {_table(model)} INCLUDING ALL)'
+            )
+        # Foreign keys are not copied by LIKE. They are named like the live
+        # ones, so that the swapped tables match the migrations.
+        for model in (SectionDetails, SectionAccidents):
+            cursor.execute(
+                f'ALTER TABLE {_table(model, SCHEMA)} '
+                f'ADD CONSTRAINT {connection.ops.quote_name(_foreign_key(cursor, model))} '
+                f'FOREIGN KEY (section_id) '
+                f'REFERENCES {_table(Section, SCHEMA)} (id) '
+                'DEFERRABLE INITIALLY DEFERRED'
+            )
+        for model in (m for m in MODELS if m in copy):
+            cursor.execute(
+                f'INSERT INTO {_table(model, SCHEMA)} SELECT * FROM {_table(model)}'
+            )
+        if SectionDetails in copy:
+            cursor.execute(
+                f'INSERT INTO {_table(Photo, SCHEMA)} '
+                f'SELECT * FROM {_table(Photo)} WHERE content_type_id = %s',
+                [ContentType.objects.get_for_model(SectionDetails).pk],
+            )
+
+
+@contextmanager
+def using():
+    """Direct queries to the staging tables
+
+    This applies to the current database connection and to connections
+    opened in the meantime, e.g. by worker processes.
+    """
+    options = connection.settings_dict.setdefault('OPTIONS', {})
+    previous_options = options.get('options')
+    options['options'] = f'-c search_path={SCHEMA},public'
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW search_path')
+        (search_path,) = cursor.fetchone()
+        cursor.execute(f'SET search_path TO {SCHEMA}, public')
+    try:
+        yield
+    finally:
+        if previous_options is None:
+            del options['options']
+        else:
+            options['options'] = previous_options
+        with connection.cursor() as cursor:
+            cursor.execute(f'SET search_path TO {search_path}')
+
+
+def validate(schema=SCHEMA):
+    """Check the staged dataset before it replaces the live data
+
+    Parameters:
+        schema (str): Schema of the checked tables, `public` to check the
+            live data after it has been updated in place
+
+    Raises:
+        StagingError: If the staged dataset is not complete
+    """
+    with connection.cursor() as cursor:
+        for model in (Section, SectionDetails, SectionAccidents):
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {_table(model, schema)})')
+            if not cursor.fetchone()[0]:
+                raise StagingError(f'No {model._meta.verbose_name_plural} staged')
+
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {_table(Section, schema)} '
+            'WHERE hbi_happy_bike_index IS NULL'
+        )
+        (missing_scores,) = cursor.fetchone()
+        if missing_scores > 0:
+            raise StagingError(f'{missing_scores} staged sections have no HBI')
+
+
+def changed_sections():
+    """Return the ids of sections whose staged data differs from the live data
+
+    Sections, details and accident datasets are compared by their row hashes,
+    see `fixmyapp.management.diff`.
+    """
+    queries = [
+        f'SELECT {column} FROM {_table(model, SCHEMA)} AS staged '
+        f'FULL JOIN {_table(model)} AS live USING ({key}) '
+        'WHERE staged.row_hash IS DISTINCT FROM live.row_hash'
+        for model, column, key in (
+            (Section, 'id', 'id'),
+            (SectionDetails, 'section_id', 'section_id, side'),
+            (SectionAccidents, 'section_id', 'section_id, side'),
+        )
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(' UNION '.join(queries))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def swap():
+    """Replace the live dataset with the staged dataset and drop the staging
+    tables
+
+    The staged section, details and accidents tables replace the live tables.
+    Their indexes and constraints are renamed to the names of the live ones,
+    which LIKE does not preserve, and the id sequences are kept. Photos of
+    section details are replaced as well. All other photos are kept.
+    """
+    qn = connection.ops.quote_name
+    details_type = ContentType.objects.get_for_model(SectionDetails)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Tables with pending foreign key checks cannot be altered
+        connection.check_constraints()
+
+        cursor.execute(
+            f'DELETE FROM {_table(Photo)} WHERE content_type_id = %s',
+            [details_type.pk],
+        )
+        cursor.execute(
+            f'INSERT INTO {_table(Photo)} SELECT * FROM {_table(Photo, SCHEMA)}'
+        )
+
+        sequences = {}
+        for model in MODELS[:-1]:
+            live = _indexes(cursor, _table(model))
+            for key, name in _indexes(cursor, _table(model, SCHEMA)).items():
+                if key in live and live[key] != name:
+                    cursor.execute(
+                        f'ALTER INDEX {qn(SCHEMA)}.{qn(name)} '
+                        f'RENAME TO {qn(live[key])}'
+                    )
+            # Sequences owned by a table would be dropped along with it
+            cursor.execute(
+                'SELECT pg_get_serial_sequence(%s, %s)', [_table(model), 'id']
+            )
+            (sequences[model],) = cursor.fetchone()
+            if sequences[model] is not None:
+                cursor.execute(f'ALTER SEQUENCE {sequences[model]} OWNED BY NONE')
+
+        cursor.execute(f'DROP SCHEMA IF EXISTS {PREVIOUS_SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {PREVIOUS_SCHEMA}')
+        for model in MODELS[:-1]:
+            cursor.execute(f'ALTER TABLE {_table(model)} SET SCHEMA {PREVIOUS_SCHEMA}')
+        for model in MODELS[:-1]:
+            cursor.execute(f'ALTER TABLE {_table(model, SCHEMA)} SET SCHEMA public')
+        cursor.execute(f'DROP SCHEMA {PREVIOUS_SCHEMA} CASCADE')
+
+        for model, sequence in sequences.items():
+            if sequence is not None:
+                cursor.execute(
+                    f'ALTER SEQUENCE {sequence} OWNED BY {_table(model)}.{qn("id")}'
+                )
+    drop()
+    tiles.invalidate('sections')
+
+
+def drop():
+    """Remove the staging tables"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
@@ -8,15 +8,29 @@ from datetime import date, datetime, timezone, timedelta
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import GEOSGeometry
 from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.mail.backends.base import BaseEmailBackend
 from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from mailjet_rest.client import Endpoint
 from unittest.mock import patch
-from .models import Project, Section, SectionAccidents, SectionDetails, GastroSignup
+from . import hbi, staging, tiles
+from .caching import bump_version
+from .models import (
+    GastroSignup,
+    Like,
+    Project,
+    Section,
+    SectionAccidents,
+    SectionDetails,
+)
 from .serializers import SectionAccidentsSerializer
 
 
@@ -46,6 +60,25 @@ class SectionTest(TestCase):
         )
 
 
+class ProjectTest(TestCase):
+    fixtures = ['projects']
+
+    def test_with_measures(self):
+        """Test that the database computes the same measures as GEOS."""
+        Project.objects.filter(pk=4).update(
+            geometry=GEOSGeometry(
+                'SRID=4326;MULTILINESTRING((13.4 52.5, 13.41 52.51, 13.43 52.51))'
+            )
+        )
+        for project in Project.objects.with_measures():
+            if project.geometry is None:
+                self.assertIsNone(project.db_center)
+                self.assertIsNone(project.db_length)
+                continue
+            self.assertAlmostEqual(project.db_length, project.length(), 3)
+            self.assertTrue(project.db_center.equals_exact(project.center(), 1e-9))
+
+
 class SectionDetailsTest(TestCase):
     def setUp(self):
         self.sections = [
@@ -224,6 +257,150 @@ class SectionDetailsTest(TestCase):
             self.details[2].cycling_infrastructure_ratio(), decimal.Decimal('0.00')
         )
 
+    def test_batch_engine(self):
+        self.details[2].length = decimal.Decimal('0.00')
+        self.details[2].crossings = 0
+
+        results = hbi.compute_for_details(self.details)
+        for detail in self.details:
+            for name in hbi.INDICES:
+                self.assertAlmostEqual(
+                    results[detail.pk][name],
+                    float(getattr(detail, name)()),
+                    6,
+                    f'{name} of {detail}',
+                )
+
+    def test_update_scores(self):
+        hbi.update_scores()
+
+        for detail in self.details:
+            detail.refresh_from_db()
+            for name in hbi.INDICES:
+                self.assertAlmostEqual(
+                    getattr(detail, f'hbi_{name}'),
+                    float(getattr(detail, name)()),
+                    6,
+                    f'{name} of {detail}',
+                )
+
+        for section in self.sections:
+            section.refresh_from_db()
+            self.assertAlmostEqual(
+                section.hbi_velocity_index, float(section.velocity_index()), 6
+            )
+            self.assertAlmostEqual(
+                section.hbi_safety_index, float(section.safety_index()), 6
+            )
+            self.assertAlmostEqual(
+                section.hbi_happy_bike_index,
+                section.hbi_velocity_index + section.hbi_safety_index,
+                6,
+            )
+
+        section = Section.objects.create(street_name='Baz')
+        hbi.update_scores(Section.objects.filter(pk=section.pk))
+        section.refresh_from_db()
+        self.assertEqual(section.hbi_velocity_index, 0)
+
+
+class HBIEngineTest(TestCase):
+    fixtures = ['sections', 'sectiondetails']
+
+    def test_parity(self):
+        """Test that batch computation matches the model methods"""
+        details = SectionDetails.objects.all()
+        results = hbi.compute_for_details(details)
+        self.assertEqual(len(results), details.count())
+        for detail in details:
+            for name in hbi.INDICES:
+                self.assertAlmostEqual(
+                    results[detail.pk][name],
+                    float(getattr(detail, name)()),
+                    6,
+                    f'{name} of {detail}',
+                )
+
+    def test_section_averages(self):
+        _, results = hbi.compute_for_sections(SectionDetails.objects.all())
+        sections = Section.objects.filter(details__isnull=False).distinct()
+        self.assertEqual(len(results), sections.count())
+        for section in sections:
+            self.assertAlmostEqual(
+                results[section.pk]['velocity_index'],
+                float(section.velocity_index()),
+                6,
+            )
+            self.assertAlmostEqual(
+                results[section.pk]['safety_index'], float(section.safety_index()), 6
+            )
+
+    def test_empty(self):
+        self.assertEqual(hbi.compute_for_details(SectionDetails.objects.none()), {})
+
+
+class StagingTest(TestCase):
+    fixtures = ['sections', 'sectiondetails', 'sectionaccidents']
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            return {
+                model: staging._indexes(cursor, staging._table(model))
+                for model in (Section, SectionDetails, SectionAccidents)
+            }
+
+    def test_swap(self):
+        indexes = self.indexes()
+        staging.create()
+        with staging.using():
+            self.assertEqual(Section.objects.count(), 0)
+            call_command('loaddata', 'sections', 'sectiondetails', 'sectionaccidents')
+            Section.objects.filter(pk__in=[2725, 46520027]).delete()
+            hbi.update_scores()
+
+        # The live dataset is unchanged until the staged dataset is swapped in
+        self.assertEqual(Section.objects.count(), 10)
+        self.assertTrue(SectionDetails.objects.filter(section_id=2725).exists())
+
+        staging.validate()
+        staging.swap()
+        self.assertEqual(Section.objects.count(), 8)
+        self.assertFalse(SectionDetails.objects.filter(section_id=2725).exists())
+        self.assertFalse(SectionAccidents.objects.filter(section_id=46520027).exists())
+        self.assertEqual(SectionAccidents.objects.count(), 4)
+
+        # The swapped tables have the names of the previous indexes and
+        # constraints, and continue their id sequences
+        self.assertEqual(self.indexes(), indexes)
+        details = SectionDetails.objects.first()
+        details.pk = None
+        details.side = 2
+        details.save()
+        self.assertGreater(details.pk, 0)
+
+    def test_copy(self):
+        staging.create(copy=(Section, SectionDetails))
+        with staging.using():
+            self.assertEqual(Section.objects.count(), 10)
+            self.assertEqual(SectionDetails.objects.count(), 7)
+            self.assertEqual(SectionAccidents.objects.count(), 0)
+        staging.drop()
+
+    def test_validate(self):
+        staging.create()
+        with self.assertRaises(staging.StagingError):
+            staging.validate()
+        staging.drop()
+
+    def test_changed_sections(self):
+        staging.create(copy=(Section, SectionDetails, SectionAccidents))
+        self.assertEqual(staging.changed_sections(), set())
+        with staging.using():
+            Section.objects.filter(pk=2725).update(row_hash='changed')
+            SectionAccidents.objects.filter(section_id=46520027).delete()
+        self.assertEqual(staging.changed_sections(), {2725, 46520027})
+        staging.drop()
+
 
 class SectionAccidentsTest(TestCase):
     def setUp(self):
@@ -867,6 +1044,36 @@ class LikeTest(object):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {'user_has_liked': False, 'likes': 0})
 
+    def test_like_count(self):
+        for i in range(3):
+            user = get_user_model().objects.create_user(f'user{i}')
+            Like.objects.create(content_object=self.instance, user=user)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.like_count, 3)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(content_object=self.instance, user=user)
+
+        header = self._get_authorization_header()
+        with CaptureQueriesContext(connection) as like:
+            response = self.client.post(self.likes_url, **header)
+        self.assertEqual(response.json(), {'user_has_liked': True, 'likes': 4})
+        with CaptureQueriesContext(connection) as unlike:
+            response = self.client.post(self.likes_url, **header)
+        self.assertEqual(response.json(), {'user_has_liked': False, 'likes': 3})
+
+        # Toggling does not depend on the number of likes
+        Like.objects.filter(user=user).delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.likes_url, **header)
+        self.assertEqual(len(queries), len(like))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.likes_url, **header)
+        self.assertEqual(len(queries), len(unlike))
+
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.like_count, 2)
+
     def _get_authorization_header(self):
         response = self.client.post(
             '/api/jwt/create/',
@@ -928,6 +1135,63 @@ class ViewsTest(TestCase):
         self.assertEqual(response.get('Content-Type'), 'application/json')
         self.assertEqual(response.json().get('count'), 3)
 
+    def test_project_list_cache(self):
+        cache.clear()
+        response = self.client.get('/api/projects')
+        etag = response.get('ETag')
+        self.assertIsNotNone(etag)
+        self.assertIn('Last-Modified', response)
+
+        # Only the dataset version is read
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/projects')
+        self.assertEqual(response.get('ETag'), etag)
+
+        response = self.client.get('/api/projects', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Changes are visible immediately
+        project = Project.objects.get(pk=4)
+        project.title = 'Umbenanntes Projekt'
+        project.save()
+        response = self.client.get('/api/projects', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get('ETag'), etag)
+        self.assertIn(
+            'Umbenanntes Projekt', [p['title'] for p in response.json()['results']]
+        )
+
+    def test_project_list_cache_shared_version(self):
+        """Test that versions bumped by other processes invalidate responses."""
+        cache.clear()
+        self.client.get('/api/projects')
+        # Another process saves a project. Its cache is not shared with this
+        # process, only its database.
+        Project.objects.filter(pk=4).update(title='Umbenanntes Projekt')
+        with patch('fixmyapp.caching.cache', new=LocMemCache('other', {})):
+            bump_version('projects')
+        response = self.client.get('/api/projects')
+        self.assertIn(
+            'Umbenanntes Projekt', [p['title'] for p in response.json()['results']]
+        )
+
+    def test_project_list_likes(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as without_likes:
+            self.client.get('/api/projects')
+
+        project = Project.objects.get(pk=4)
+        for i in range(3):
+            user = get_user_model().objects.create_user(f'user{i}')
+            Like.objects.create(content_object=project, user=user)
+
+        with CaptureQueriesContext(connection) as with_likes:
+            response = self.client.get('/api/projects')
+        self.assertEqual(len(with_likes), len(without_likes))
+        likes = {p['id']: p['likes'] for p in response.json()['results']}
+        self.assertEqual(likes[4], 3)
+        self.assertEqual(sum(likes.values()), 3)
+
     def test_project_detail(self):
         response = self.client.get('/api/projects/4')
         self.assertEqual(response.status_code, 200)
@@ -940,9 +1204,164 @@ class ViewsTest(TestCase):
         self.assertEqual(response.get('Content-Type'), 'application/json')
         self.assertEqual(response.json().get('count'), 10)
 
+    def test_section_list_filters(self):
+        response = self.client.get('/api/sections', {'min_hbi': 5, 'max_hbi': 8})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json().get('count'),
+            Section.objects.filter(
+                hbi_happy_bike_index__gte=5, hbi_happy_bike_index__lte=8
+            ).count(),
+        )
+        for section in response.json()['results']:
+            self.assertTrue(5 <= section['happy_bike_index'] <= 8, section)
+
+        response = self.client.get('/api/sections', {'is_road': 'false'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json().get('count'), Section.objects.filter(is_road=False).count()
+        )
+
+        response = self.client.get(
+            '/api/sections', {'borough': 'Friedrichshain-Kreuzberg'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json().get('count'),
+            Section.objects.filter(borough='Friedrichshain-Kreuzberg').count(),
+        )
+
+    def test_section_list_ordering(self):
+        response = self.client.get(
+            '/api/sections', {'ordering': '-safety_index', 'page_size': 100}
+        )
+        self.assertEqual(response.status_code, 200)
+        values = [s['safety_index'] for s in response.json()['results']]
+        self.assertEqual(values, sorted(values, reverse=True))
+
+        # Sections without stored scores are listed last
+        Section.objects.filter(
+            pk=Section.objects.order_by('id').values('id')[:1]
+        ).update(hbi_safety_index=None)
+        for ordering in ('safety_index', '-safety_index'):
+            response = self.client.get(
+                '/api/sections', {'ordering': ordering, 'page_size': 100}
+            )
+            self.assertEqual(response.status_code, 200)
+            values = [s['safety_index'] for s in response.json()['results']]
+            self.assertIsNone(values[-1], ordering)
+            self.assertNotIn(None, values[:-1], ordering)
+
+        for params in [
+            {'ordering': 'geometry'},
+            {'min_hbi': 'foo'},
+            {'is_road': 'maybe'},
+        ]:
+            response = self.client.get('/api/sections', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_section_list_bbox(self):
+        response = self.client.get('/api/sections', {'bbox': '13.55,52.45,13.57,52.46'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [s['url'].rstrip('/').split('/')[-1] for s in response.json()['results']],
+            ['57470003'],
+        )
+
+        for bbox in ('13.55,52.45,13.57', '13.57,52.45,13.55,52.46', 'a,b,c,d'):
+            response = self.client.get('/api/sections', {'bbox': bbox})
+            self.assertEqual(response.status_code, 400, bbox)
+
+    def test_section_list_zoom(self):
+        full = self.client.get('/api/sections', {'page_size': 100}).json()
+        response = self.client.get('/api/sections', {'page_size': 100, 'zoom': 10})
+        self.assertEqual(response.status_code, 200)
+        simplified = response.json()
+
+        def coordinates(section):
+            return [c for line in section['geometry']['coordinates'] for c in line]
+
+        for a, b in zip(full['results'], simplified['results']):
+            self.assertEqual(a['url'], b['url'])
+            self.assertLessEqual(len(coordinates(b)), len(coordinates(a)))
+            for lon, lat in coordinates(b):
+                self.assertEqual(lon, round(lon, 3))
+                self.assertEqual(lat, round(lat, 3))
+        self.assertLess(len(response.content), len(json.dumps(full)))
+
+        for zoom in ('-1', '23', 'a'):
+            response = self.client.get('/api/sections', {'zoom': zoom})
+            self.assertEqual(response.status_code, 400, zoom)
+
+    def test_section_list_queries(self):
+        # count, sections, details, details' photos and accidents
+        for page_size in (1, 1000):
+            with self.assertNumQueries(5):
+                response = self.client.get('/api/sections', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), Section.objects.count())
+
     def test_section_detail(self):
+        with self.assertNumQueries(4):
+            self.client.get('/api/sections/2725')
         response = self.client.get('/api/sections/2725')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get('Content-Type'), 'application/json')
         self.assertIn('geometry', response.json())
         self.assertIn('details', response.json())
+
+
+class TileTest(TestCase):
+
+    fixtures = ['sections', 'sectiondetails', 'sectionaccidents']
+
+    # Tile at zoom level 12 containing section 2725
+    url = '/api/tiles/sections/12/2200/1343.mvt'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.get('Content-Type'), 'application/vnd.mapbox-vector-tile'
+        )
+        self.assertIn(b'sections', response.content)
+        self.assertIn(b'side0_velocity', response.content)
+
+    def test_empty_tile(self):
+        response = self.client.get('/api/tiles/sections/12/0/0.mvt')
+        self.assertEqual(response.status_code, 204)
+
+    def test_invalid_tile(self):
+        for url in (
+            '/api/tiles/unknown/12/2200/1343.mvt',
+            '/api/tiles/sections/12/4096/1343.mvt',
+            '/api/tiles/sections/23/0/0.mvt',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+
+    def test_cache(self):
+        content = self.client.get(self.url).content
+        # Only the dataset version is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).content, content)
+
+        section = Section.objects.get(pk=2725)
+        section.street_name = 'Umbenannte Straße'
+        section.save()
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertNotEqual(response.content, content)
+
+    def test_invalidate_from_command(self):
+        """Test that tiles invalidated by a management command process are
+        rendered again by web workers"""
+        content = self.client.get(self.url).content
+        Section.objects.filter(pk=2725).update(street_name='Umbenannte Straße')
+        # Commands run in processes with their own cache
+        with patch('fixmyapp.caching.cache', new=LocMemCache('command', {})):
+            tiles.invalidate('sections')
+        self.assertNotEqual(self.client.get(self.url).content, content)
@@ -0,0 +1,233 @@
+"""Mapbox Vector Tiles built from PostGIS
+
+Each `Layer` describes a query whose rows become the features of one tile
+layer. Tiles are encoded by PostGIS using `ST_AsMVT` and cached until a row of
+one of the layer's models is saved or deleted, or `invalidate` is called after
+bulk operations that bypass model signals. The layer versions are stored in
+the database, so tiles invalidated by import commands are rendered again by
+all web workers.
+"""
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+
+from .caching import bump_version, get_version
+from .geo import MAX_ZOOM
+
+# Tile coordinate range and buffer in MVT units
+EXTENT = 4096
+BUFFER = 64
+
+# Seconds that tiles are kept in the cache
+CACHE_TIMEOUT = 60 * 60 * 24
+
+LAYERS = {}
+
+
+class Layer:
+    """A tile layer
+
+    Parameters:
+        name (str): Name of the layer in URLs and tiles
+        models (tuple): Labels of the models whose changes invalidate tiles
+        table (str): Table containing the features, available as `t`. Its
+            `geometry` column must be in WGS 84.
+        columns (str): SQL expressions for the feature properties
+        joins (str): Joins providing additional properties
+        where (str): Condition limiting the features
+    """
+
+    def __init__(self, name, models, table, columns, joins='', where='TRUE'):
+        self.name = name
+        self.models = models
+        self.table = table
+        self.where = where
+        self.sql = f'''
+            WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom)
+            SELECT ST_AsMVT(features, %(name)s, {EXTENT}, 'geom') FROM (
+                SELECT
+                    ST_AsMVTGeom(
+                        ST_Transform(t.geometry, 3857),
+                        bounds.geom,
+                        {EXTENT},
+                        {BUFFER},
+                        true
+                    ) AS geom,
+                    {columns}
+                FROM bounds, {table} t {joins}
+                WHERE t.geometry && ST_Transform(bounds.geom, 4326) AND {where}
+            ) AS features
+        '''
+
+    def render(self, z, x, y):
+        """Encode a tile, returns an empty bytestring if it has no features"""
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, {'name': self.name, 'z': z, 'x': x, 'y': y})
+            row = cursor.fetchone()
+        return bytes(row[0] or b'') if row else b''
+
+    def has_features(self, z, x, y):
+        """Whether the bounding box of any feature intersects a tile
+
+        Unlike a rendered tile, which can be empty because its features are
+        too small to be encoded, this also holds for all tiles containing the
+        tile, so tiles without features can be skipped with their children.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                SELECT EXISTS (
+                    SELECT 1 FROM {self.table} t
+                    WHERE t.geometry && ST_Transform(
+                        ST_TileEnvelope(%(z)s, %(x)s, %(y)s), 4326
+                    ) AND {self.where}
+                )
+                ''',
+                {'z': z, 'x': x, 'y': y},
+            )
+            return cursor.fetchone()[0]
+
+    def extent(self):
+        """Bounding box of all features, `None` if there are none
+
+        Returns:
+            tuple: Minimum longitude, minimum latitude, maximum longitude and
+                maximum latitude
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (
+                    SELECT ST_Extent(t.geometry) AS e
+                    FROM {self.table} t
+                    WHERE {self.where}
+                ) AS extent
+                '''
+            )
+            row = cursor.fetchone()
+        return None if row[0] is None else row
+
+    def invalidate(self, **kwargs):
+        bump_version(f'tiles:{self.name}')
+
+
+def register(layer):
+    """Make a layer available and invalidate it on changes of its models"""
+    LAYERS[layer.name] = layer
+    for label in layer.models:
+        model = apps.get_model(label)
+        for signal in (post_save, post_delete):
+            signal.connect(
+                layer.invalidate,
+                sender=model,
+                weak=False,
+                dispatch_uid=f'tiles-{layer.name}',
+            )
+
+
+def invalidate(name):
+    """Discard all cached tiles of a layer"""
+    LAYERS[name].invalidate()
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def get_tile(name, z, x, y):
+    """Return a cached or newly rendered tile
+
+    Raises:
+        KeyError: If there is no layer with this name
+    """
+    layer = LAYERS[name]
+    version = get_version(f'tiles:{name}')
+    key = f'tiles:{name}:{version}:{z}/{x}/{y}'
+    tile = cache.get(key)
+    if tile is None:
+        tile = layer.render(z, x, y)
+        cache.set(key, tile, CACHE_TIMEOUT)
+    return tile
+
+
+def _pivot(table, columns, sides, where='TRUE'):
+    """Join the rows of a table referencing sections as side-prefixed columns"""
+    values = ', '.join(
+        f'MAX({column}) FILTER (WHERE side = {side}) AS side{side}_{name}'
+        for side in sides
+        for name, column in columns
+    )
+    return (
+        f'LEFT JOIN LATERAL (SELECT {values} FROM {table} '
+        f'WHERE section_id = t.id AND {where}) AS {table} ON TRUE'
+    )
+
+
+SECTIONS = Layer(
+    'sections',
+    ('fixmyapp.Section', 'fixmyapp.SectionDetails', 'fixmyapp.SectionAccidents'),
+    'fixmyapp_section',
+    '''
+        t.id,
+        t.street_name,
+        t.suffix,
+        t.borough,
+        t.street_category,
+        t.is_road,
+        CASE WHEN t.is_road THEN round(t.hbi_velocity_index::numeric, 3) END
+            AS velocity,
+        CASE WHEN t.is_road THEN round(t.hbi_safety_index::numeric, 3) END
+            AS safety,
+        fixmyapp_sectiondetails.*,
+        fixmyapp_sectionaccidents.*
+    ''',
+    # the HBI is only exported for road sections, see `exportsections`
+    _pivot(
+        'fixmyapp_sectiondetails',
+        (
+            ('orientation', 'orientation'),
+            ('velocity', 'round(hbi_velocity_index::numeric, 3)'),
+            ('safety', 'round(hbi_safety_index::numeric, 3)'),
+        ),
+        (0, 1),
+        where='t.is_road',
+    )
+    + ' '
+    + _pivot(
+        'fixmyapp_sectionaccidents',
+        (
+            ('killed', 'killed'),
+            ('severely_injured', 'severely_injured'),
+            ('slightly_injured', 'slightly_injured'),
+            ('source', 'source'),
+            ('risk_level', 'risk_level'),
+        ),
+        (0, 1, 2),
+    ),
+)
+
+PROJECTS = Layer(
+    'projects',
+    ('fixmyapp.Project',),
+    'fixmyapp_project',
+    '''
+        t.id,
+        t.title,
+        t.side,
+        t.responsible,
+        t.short_description,
+        t.category,
+        t.project_key,
+        t.street_name,
+        t.borough,
+        t.costs,
+        t.draft_submitted,
+        t.construction_started,
+        t.construction_completed,
+        t.phase,
+        t.status,
+        t.external_url
+    ''',
+    where='t.published',
+)
@@ -1,5 +1,4 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 from .models import Project
 from .views import (
     feedback,
@@ -15,6 +14,7 @@ from .views import (
     ProjectList,
     SectionDetail,
     SectionList,
+    tile,
 )
 
 # fmt: off
@@ -66,7 +66,7 @@ urlpatterns = [
     ),
     path(
         'projects',
-        cache_page(60 * 60 * 4)(ProjectList.as_view()),
+        ProjectList.as_view(),
         name='project-list'
     ),
     path(
@@ -95,6 +95,11 @@ urlpatterns = [
         PlayStreetView.as_view(),
         name='playstreets'
     ),
+    path(
+        'tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt',
+        tile,
+        name='tile'
+    ),
     path(
         'users/me/liked/projects',
         LikedByUserProjectList.as_view(),
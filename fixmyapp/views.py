@@ -6,18 +6,34 @@ import sys
 from datetime import datetime, timezone
 from django.conf import settings
 from django.core import mail
-from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import require_GET
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.parsers import FileUploadParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Like, GastroSignup, Profile, Project, Section, PlaystreetSignup
+from .caching import VersionedCacheMixin
+from .geo import parse_bbox, parse_zoom, simplified
+from .models import (
+    Like,
+    GastroSignup,
+    Photo,
+    Profile,
+    Project,
+    PlaystreetSignup,
+    Question,
+    Section,
+)
 from .serializers import (
     FeedbackSerializer,
     GastroSignupSerializer,
@@ -30,6 +46,7 @@ from .serializers import (
     SectionSerializer,
 )
 from .signals import sign_up_newsletter
+from . import tiles
 
 
 class DefaultPagination(PageNumberPagination):
@@ -44,32 +61,131 @@ class LikedByUserProjectList(generics.ListAPIView):
     serializer_class = ProjectSerializer
 
     def get_queryset(self):
-        return Project.objects.filter(
-            likes__in=Like.objects.filter(user=self.request.user)
-        ).order_by('id')
+        return (
+            Project.objects.filter(
+                likes__in=Like.objects.filter(user=self.request.user)
+            )
+            .with_measures()
+            .order_by('id')
+        )
+
 
+class ProjectList(VersionedCacheMixin, generics.ListAPIView):
+    """List published projects
 
-class ProjectList(generics.ListAPIView):
+    Responses are cached until a project, photo, question or like changes.
+    """
+
+    cache_version = 'projects'
     pagination_class = DefaultPagination
     queryset = (
-        Project.objects.filter(published=1).order_by('id').prefetch_related('likes')
+        Project.objects.filter(published=1)
+        .with_measures()
+        .order_by('id')
+        .prefetch_related('faq', 'photos')
     )
     serializer_class = ProjectSerializer
 
+    def get_last_modified(self):
+        projects = Project.objects.filter(published=1)
+        content_type = ContentType.objects.get_for_model(Project)
+        related = {'content_type': content_type, 'object_id__in': projects.values('id')}
+        dates = [
+            queryset.aggregate(Max('modified_date'))['modified_date__max']
+            for queryset in (
+                projects,
+                Photo.objects.filter(**related),
+                Like.objects.filter(**related),
+                Question.objects.filter(project__in=projects),
+            )
+        ]
+        return max((d for d in dates if d is not None), default=None)
+
 
 class ProjectDetail(generics.RetrieveAPIView):
-    queryset = Project.objects.filter(published=1)
+    queryset = Project.objects.filter(published=1).with_measures()
     serializer_class = ProjectSerializer
 
 
 class SectionList(generics.ListAPIView):
+    """List sections, optionally filtered and ordered by their HBI
+
+    Query parameters:
+
+    - `min_hbi`, `max_hbi`: limit the range of the happy bike index
+    - `borough`: only list sections in this borough
+    - `is_road`: only list road sections (`true`) or intersections (`false`)
+    - `bbox`: only list sections intersecting `min_lon,min_lat,max_lon,max_lat`
+    - `zoom`: simplify geometries for display at this map zoom level
+    - `ordering`: comma-separated list of the fields in `ORDERING_FIELDS`,
+      prefixed with `-` for descending order
+    """
+
+    ORDERING_FIELDS = {
+        'id': 'id',
+        'happy_bike_index': 'hbi_happy_bike_index',
+        'safety_index': 'hbi_safety_index',
+        'street_name': 'street_name',
+        'velocity_index': 'hbi_velocity_index',
+    }
+
     pagination_class = DefaultPagination
-    queryset = Section.objects.all().order_by('id')
     serializer_class = SectionSerializer
 
+    def get_queryset(self):
+        queryset = Section.objects.prefetch_related(
+            'details', 'details__photos', 'accidents'
+        )
+        params = self.request.query_params
+
+        for param, lookup in (
+            ('min_hbi', 'hbi_happy_bike_index__gte'),
+            ('max_hbi', 'hbi_happy_bike_index__lte'),
+        ):
+            if param in params:
+                try:
+                    queryset = queryset.filter(**{lookup: float(params[param])})
+                except ValueError:
+                    raise ValidationError({param: _('A valid number is required.')})
+
+        if 'borough' in params:
+            queryset = queryset.filter(borough=params['borough'])
+
+        if 'is_road' in params:
+            if params['is_road'].lower() not in ('true', 'false', '1', '0'):
+                raise ValidationError({'is_road': _('Must be either true or false.')})
+            queryset = queryset.filter(
+                is_road=params['is_road'].lower() in ('true', '1')
+            )
+
+        if 'bbox' in params:
+            queryset = queryset.filter(geometry__intersects=parse_bbox(params['bbox']))
+
+        if 'zoom' in params:
+            zoom = parse_zoom(params['zoom'])
+            queryset = queryset.defer('geometry').annotate(
+                simplified_geometry=simplified('geometry', zoom)
+            )
+
+        ordering = []
+        for field in params.get('ordering', 'id').split(','):
+            try:
+                expression = F(self.ORDERING_FIELDS[field.lstrip('-')])
+            except KeyError:
+                raise ValidationError({'ordering': _('Invalid ordering field.')})
+            # Sections without stored scores are listed last in either order
+            if field.startswith('-'):
+                ordering.append(expression.desc(nulls_last=True))
+            else:
+                ordering.append(expression.asc(nulls_last=True))
+        # Order by id last for stable pagination
+        return queryset.order_by(*ordering, 'id')
+
 
 class SectionDetail(generics.RetrieveAPIView):
-    queryset = Section.objects.all()
+    queryset = Section.objects.prefetch_related(
+        'details', 'details__photos', 'accidents'
+    )
     serializer_class = SectionSerializer
 
 
@@ -81,28 +197,39 @@ class LikeView(APIView):
     def get(self, request, pk, model, format=None):
         """Returns the number of likes for an object"""
 
-        instance = get_object_or_404(model, pk=pk)
+        instance = get_object_or_404(model.objects.only('like_count'), pk=pk)
         if request.user.is_authenticated:
-            likes_by_user = instance.likes.filter(user=request.user).count()
+            user_has_liked = instance.likes.filter(user=request.user).exists()
         else:
-            likes_by_user = 0
-        likes = instance.likes.count()
-        result = {'user_has_liked': bool(likes_by_user), 'likes': likes}
+            user_has_liked = False
+        result = {'user_has_liked': user_has_liked, 'likes': instance.like_count}
         return Response(result)
 
     def post(self, request, pk, model, format=None):
-        """Adds or removes a like by the current authenticated user"""
-        instance = get_object_or_404(model, pk=pk)
-        if instance.likes.filter(user=request.user).count() == 0:
-            Like.objects.create(content_object=instance, user=request.user)
-            user_has_liked = True
-            response_status = status.HTTP_201_CREATED
-        else:
-            instance.likes.filter(user=request.user).delete()
-            user_has_liked = False
-            response_status = status.HTTP_200_OK
-
-        result = {'user_has_liked': user_has_liked, 'likes': instance.likes.count()}
+        """Adds or removes a like by the current authenticated user
+
+        The liked object's row is locked until the like and its like counter
+        have been written, so that concurrent requests for the same object
+        are applied one after another and return consistent counts.
+        """
+        with transaction.atomic():
+            instance = get_object_or_404(
+                model.objects.select_for_update().only('like_count'), pk=pk
+            )
+            like = instance.likes.filter(user=request.user).first()
+            # The like counter is updated by `signals.update_like_count`
+            if like is None:
+                Like.objects.create(content_object=instance, user=request.user)
+                user_has_liked = True
+                likes = instance.like_count + 1
+                response_status = status.HTTP_201_CREATED
+            else:
+                like.delete()
+                user_has_liked = False
+                likes = instance.like_count - 1
+                response_status = status.HTTP_200_OK
+
+        result = {'user_has_liked': user_has_liked, 'likes': likes}
         return Response(result, status=response_status)
 
 
@@ -324,6 +451,19 @@ class GastroRenewalView(APIView):
         return Response(serialization)
 
 
+@require_GET
+def tile(request, layer, z, x, y):
+    """Returns a Mapbox Vector Tile of a layer in `fixmyapp.tiles.LAYERS`"""
+    if layer not in tiles.LAYERS or not tiles.is_valid_tile(z, x, y):
+        raise Http404
+    content = tiles.get_tile(layer, z, x, y)
+    return HttpResponse(
+        content,
+        content_type='application/vnd.mapbox-vector-tile',
+        status=status.HTTP_200_OK if content else status.HTTP_204_NO_CONTENT,
+    )
+
+
 @api_view(['PUT'])
 def profile(request, profile_id):
     try:
@@ -5,3 +5,16 @@ from django.utils.translation import gettext_lazy as _
 class ReportsConfig(AppConfig):
     name = 'reports'
     verbose_name = _('Reports App')
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from fixmyapp import tiles
+        from . import clusters, stats
+        from .tiles import REPORTS
+
+        tiles.register(REPORTS)
+
+        for model in (self.get_model('Report'), self.get_model('BikeStands')):
+            for receiver in (clusters.invalidate, stats.invalidate):
+                post_save.connect(receiver, sender=model)
+                post_delete.connect(receiver, sender=model)
@@ -0,0 +1,143 @@
+"""Clusters of bike stands reports for zoomed-out maps
+
+Reports are grouped into the cells of a grid whose size depends on the zoom
+level, using `ST_SnapToGrid`. Clusters are cached per block of
+`BLOCK_SIZE` x `BLOCK_SIZE` cells, so that requests for overlapping map views
+share cache entries. The cache is invalidated when a report is saved or
+deleted. Its version is stored in the database, so that reports changed by
+other processes, e.g. by `importreports`, are seen by all web workers.
+"""
+import math
+
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+
+from fixmyapp.caching import bump_version, get_version
+from fixmyapp.geo import pixel_size
+from .models import BikeStands, Report
+
+# Width and height of a grid cell in pixels
+CELL_SIZE = 64
+
+# Number of cells along each side of the blocks that are cached together
+BLOCK_SIZE = 16
+
+# Seconds that clusters are kept in the cache
+CACHE_TIMEOUT = 60 * 60 * 24
+
+STATUSES = [status for status, _ in Report.STATUS_CHOICES]
+
+
+def cell_size(zoom):
+    """Width and height of a grid cell in degrees"""
+    return pixel_size(zoom) * CELL_SIZE
+
+
+def blocks(bbox, zoom):
+    """Return the x and y indices of the blocks covering a bounding box"""
+    size = cell_size(zoom) * BLOCK_SIZE
+    min_x, min_y, max_x, max_y = bbox.extent
+    return [
+        (x, y)
+        for x in range(math.floor(min_x / size), math.floor(max_x / size) + 1)
+        for y in range(math.floor(min_y / size), math.floor(max_y / size) + 1)
+    ]
+
+
+def compute(zoom, blocks):
+    """Cluster the published reports within blocks of the grid
+
+    Returns:
+        dict: Maps each block to the list of its clusters
+    """
+    size = cell_size(zoom)
+    within_blocks = Q()
+    for x, y in blocks:
+        polygon = Polygon.from_bbox(
+            (
+                x * size * BLOCK_SIZE,
+                y * size * BLOCK_SIZE,
+                (x + 1) * size * BLOCK_SIZE,
+                (y + 1) * size * BLOCK_SIZE,
+            )
+        )
+        polygon.srid = 4326
+        within_blocks |= Q(geometry__intersects=polygon)
+
+    # With the origin at half a cell, each point is snapped to the center of
+    # the cell containing it
+    cells = (
+        BikeStands.objects.filter(within_blocks, published=True)
+        .annotate(cell=SnapToGrid('geometry', size, size, size / 2, size / 2))
+        .values('cell')
+        .annotate(
+            center=Centroid(Collect('geometry')),
+            count=Count('id'),
+            bike_stands=Sum('number'),
+            **{
+                f'status_{status}': Count('id', filter=Q(status=status))
+                for status in STATUSES
+            },
+        )
+        .order_by()
+    )
+
+    clusters = {block: [] for block in blocks}
+    for row in cells:
+        block = (
+            math.floor(row['cell'].x / size) // BLOCK_SIZE,
+            math.floor(row['cell'].y / size) // BLOCK_SIZE,
+        )
+        if block not in clusters:
+            # Reports on the border of a requested block
+            continue
+        clusters[block].append(
+            {
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [
+                        round(row['center'].x, 6),
+                        round(row['center'].y, 6),
+                    ],
+                },
+                'count': row['count'],
+                'bike_stands': row['bike_stands'],
+                'statuses': {
+                    status: row[f'status_{status}']
+                    for status in STATUSES
+                    if row[f'status_{status}'] > 0
+                },
+            }
+        )
+    return clusters
+
+
+def get(bbox, zoom):
+    """Return the clusters of the blocks covering a bounding box
+
+    Clusters of blocks that are not in the cache are computed with a single
+    query.
+    """
+    version = get_version('report_clusters')
+    keys = {
+        block: f'report_clusters:{version}:{zoom}:{block[0]}:{block[1]}'
+        for block in blocks(bbox, zoom)
+    }
+    cached = cache.get_many(keys.values())
+    clusters = {block: cached[key] for block, key in keys.items() if key in cached}
+    missing = [block for block in keys if block not in clusters]
+    if len(missing) > 0:
+        computed = compute(zoom, missing)
+        cache.set_many(
+            {keys[block]: computed[block] for block in missing}, CACHE_TIMEOUT
+        )
+        clusters.update(computed)
+    return [cluster for block in keys for cluster in clusters[block]]
+
+
+def invalidate(**kwargs):
+    """Discard all cached clusters"""
+    bump_version('report_clusters')
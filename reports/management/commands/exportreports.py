@@ -45,7 +45,7 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        query = Report.objects.order_by('id').prefetch_related('likes', 'bikestands')
+        query = Report.objects.order_by('id').prefetch_related('bikestands')
         if options['format'] == 'csv':
             self.export_csv(query, options['filename'])
         else:
@@ -62,7 +62,7 @@ class Command(BaseCommand):
             row_data['lat'] = report.geometry.y
             row_data['number'] = report.bikestands.number
             row_data['fee_acceptable'] = report.bikestands.fee_acceptable is True
-            row_data['likes'] = report.likes.count()
+            row_data['likes'] = report.like_count
             row_data['url'] = report.frontend_url
             row_data['origin_ids'] = format_origin_ids(report.origin.all())
             row_data['photo'] = report.photo_url
@@ -87,7 +87,7 @@ class Command(BaseCommand):
                         "description": report.description,
                         "fee_acceptable": report.bikestands.fee_acceptable is True,
                         "id": report.id,
-                        "likes": report.likes.count(),
+                        "likes": report.like_count,
                         "number": report.bikestands.number,
                         'status': report.status,
                         "status_reason": report.status_reason,
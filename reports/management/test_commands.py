@@ -2,13 +2,16 @@ import csv
 import json
 import tempfile
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
 from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
-from fixmyapp.models import Like
+from fixmyapp.models import Like, NoticeSetting
 from reports.models import Report, BikeStands, StatusNotice
 from .commands.importreports import link_report_origins
 
@@ -186,6 +189,59 @@ class SendNotifications(TestCase):
         self.assertTrue(self.planning.user is None)
         self.assertEqual(StatusNotice.objects.count(), 1)
 
+    def test_notice_queries(self):
+        """Enqueueing notices takes the same number of queries for any number
+        of recipients"""
+        ct = ContentType.objects.get_for_model(Report)
+        user_model = get_user_model()
+
+        def change_status(status):
+            with CaptureQueriesContext(connection) as queries:
+                self.planning.status = status
+                self.planning.save()
+            return len(queries)
+
+        Like.objects.create(
+            content_type=ct,
+            object_id=self.planning.id,
+            user=user_model.objects.create_user('liker'),
+        )
+        few_recipients = change_status(Report.STATUS_TENDER)
+
+        for i in range(20):
+            user = user_model.objects.create_user(f'liker{i}')
+            Like.objects.create(content_type=ct, object_id=self.planning.id, user=user)
+        many_recipients = change_status(Report.STATUS_EXECUTION)
+
+        self.assertEqual(many_recipients, few_recipients)
+        # Likers and the author of the origin report
+        self.assertEqual(
+            StatusNotice.objects.filter(status=Report.STATUS_EXECUTION).count(), 22
+        )
+
+    def test_notice_duplicates(self):
+        """Reverting to a status on the same day does not duplicate notices and
+        users who disabled notifications are skipped"""
+        user = self.report.user
+        liker = get_user_model().objects.create_user('liker')
+        ct = ContentType.objects.get_for_model(Report)
+        Like.objects.create(content_type=ct, object_id=self.report.id, user=liker)
+        NoticeSetting.objects.create(
+            user=liker, kind=NoticeSetting.REPORT_UPDATE_KIND, send=False
+        )
+
+        for status in (
+            Report.STATUS_REPORT_INACTIVE,
+            Report.STATUS_REPORT_ACCEPTED,
+            Report.STATUS_REPORT_INACTIVE,
+        ):
+            report = Report.objects.get(pk=self.report.pk)
+            report.status = status
+            report.save()
+
+        self.assertEqual(StatusNotice.objects.filter(user=user).count(), 2)
+        self.assertEqual(StatusNotice.objects.filter(user=liker).count(), 0)
+
     def test_sendnotifications(self):
         """Test every block in the template for notification emails"""
         # Create a second report to use in testing
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.7 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    Like = apps.get_model('fixmyapp', 'Like')
+    Report = apps.get_model('reports', 'Report')
+    likes = (
+        Like.objects.filter(
+            content_type__app_label='reports',
+            content_type__model='report',
+            object_id=OuterRef('pk'),
+        )
+        .order_by()
+        .values('object_id')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    Report.objects.update(
+        like_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fixmyapp', '0099_like_counts'),
+        ('reports', '0009_unique_status_notice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='like_count',
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name='likes'
+            ),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
@@ -57,6 +57,8 @@ class Report(BaseModel):
         _('description'), blank=True, null=True, max_length=1000
     )
     likes = GenericRelation(Like)
+    # Number of likes, maintained by `fixmyapp.signals.update_like_count`
+    like_count = models.PositiveIntegerField(_('likes'), default=0, editable=False)
     photo = GenericRelation(Photo)
     published = models.BooleanField(_('published'), default=True)
     status = models.CharField(
@@ -104,21 +106,13 @@ class Report(BaseModel):
 
         from .status_notice import StatusNotice
 
-        notified_users = set()
-
-        def notify_user(user):
-            if user is not None and user not in notified_users:
-                notified_users.add(user)
-                StatusNotice.create(status=self.status, user=user, report=self)
-
-        if self.user is not None:
-            notify_user(self.user)
-
-        for like in self.likes.all():
-            notify_user(like.user)
-
-        for report in self.origin.all():
-            notify_user(report.user)
+        user_ids = set(self.likes.values_list('user_id', flat=True))
+        user_ids.update(
+            self.origin.filter(user__isnull=False).values_list('user_id', flat=True)
+        )
+        if self.user_id is not None:
+            user_ids.add(self.user_id)
+        StatusNotice.enqueue(self, user_ids)
 
     @property
     def is_report(self):
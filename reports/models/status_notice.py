@@ -1,5 +1,3 @@
-from datetime import date
-from django.db import IntegrityError
 from django.contrib.auth import get_user_model
 from django.contrib.gis.db import models
 from django.urls import reverse
@@ -32,23 +30,34 @@ class StatusNotice(models.Model):
         unique_together = [['report_id', 'user_id', 'status', 'date']]
 
     @classmethod
-    def create(cls, *args, **kwargs):
-        """Create status notice, also creating user notification pref if neccessary"""
-        setting, _created = NoticeSetting.objects.get_or_create(
-            user=kwargs.get("user"), kind=NoticeSetting.REPORT_UPDATE_KIND
+    def enqueue(cls, report, user_ids):
+        """Create notices about the current status of a report for many users
+
+        Missing notification prefs are created. Users who have disabled
+        report updates or already have a notice about this status from today
+        are skipped. Uses a fixed number of queries, however many users are
+        notified.
+        """
+        if len(user_ids) == 0:
+            return
+        NoticeSetting.objects.bulk_create(
+            [
+                NoticeSetting(user_id=user_id, kind=NoticeSetting.REPORT_UPDATE_KIND)
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+        recipients = NoticeSetting.objects.filter(
+            user_id__in=user_ids, kind=NoticeSetting.REPORT_UPDATE_KIND, send=True
+        ).values_list('user_id', flat=True)
+        # Existing notices violate the unique constraint and are ignored
+        cls.objects.bulk_create(
+            [
+                cls(report=report, status=report.status, user_id=user_id)
+                for user_id in recipients
+            ],
+            ignore_conflicts=True,
         )
-        if setting.send:
-            notice_exists = (
-                cls.objects.filter(
-                    report=kwargs.get('report'),
-                    user=kwargs.get('user'),
-                    status=kwargs.get('status'),
-                    date=date.today(),
-                ).count()
-                > 0
-            )
-            if not notice_exists:
-                return cls(*args, **kwargs).save()
 
     @staticmethod
     def unsubscribe_url(user):
@@ -53,12 +53,16 @@ class ReportBaseSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name="reports:report-detail")
 
     def get_likes(self, obj):
-        return obj.likes.count()
+        return obj.like_count
 
     def get_liked_by_user(self, obj):
+        # Provided by the views, see `reports.views.LikedReportIdsMixin`
+        liked_ids = self.context.get('liked_report_ids')
+        if liked_ids is not None:
+            return obj.id in liked_ids
         user = self.context['request'].user
         if user.is_authenticated:
-            return obj.likes.filter(user=user).count() > 0
+            return obj.likes.filter(user=user).exists()
         else:
             return False
 
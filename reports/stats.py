@@ -0,0 +1,70 @@
+"""Statistics about bike stands reports and plannings
+
+The statistics are computed by the database in a single query and cached
+until a report is saved or deleted. The version of the cached statistics is
+stored in the database, so that changes made by other processes, e.g. by
+`importreports`, are seen by all web workers. Updates through
+`QuerySet.update` bypass model signals and need to be followed by
+`invalidate`.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+
+from fixmyapp.caching import bump_version, get_version
+from .models import BikeStands, Report
+
+# Seconds that statistics are kept in the cache
+CACHE_TIMEOUT = 60 * 60 * 24
+
+REPORT_STATUSES = Report.REPORT_STATUSES
+
+# Invalid plannings are not counted
+PLANNING_STATUSES = (
+    Report.STATUS_PLANNING,
+    Report.STATUS_TENDER,
+    Report.STATUS_EXECUTION,
+    Report.STATUS_DONE,
+)
+
+
+def compute():
+    """Compute the statistics of published bike stands reports"""
+    is_report = Q(status__in=REPORT_STATUSES)
+    is_planning = Q(status__in=PLANNING_STATUSES)
+    result = BikeStands.objects.filter(published=True).aggregate(
+        reports=Count('id', filter=is_report),
+        reports_bike_stands=Sum('number', filter=is_report),
+        plannings=Count('id', filter=is_planning),
+        plannings_bike_stands=Sum('number', filter=is_planning),
+        **{
+            status: Sum('number', filter=Q(status=status))
+            for status in PLANNING_STATUSES
+        },
+    )
+    return {
+        'reports': result['reports'],
+        'reportsBikeStands': result['reports_bike_stands'] or 0,
+        'plannings': result['plannings'],
+        'planningsBikeStands': result['plannings_bike_stands'] or 0,
+        # Only statuses of existing plannings are included
+        'planningsByStatus': {
+            status: result[status]
+            for status in PLANNING_STATUSES
+            if result[status] is not None
+        },
+    }
+
+
+def get():
+    """Return cached or newly computed statistics"""
+    key = f'report_stats:{get_version("report_stats")}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute()
+        cache.set(key, stats, CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate(**kwargs):
+    """Discard the cached statistics"""
+    bump_version('report_stats')
@@ -1,16 +1,22 @@
 import json
 import tempfile
 import uuid
+from unittest.mock import patch
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
 from fixmyapp.tests import LikeTest
-from fixmyapp.models import NoticeSetting
+from fixmyapp.models import Like, NoticeSetting, Photo
 from fixmydjango.utils import get_templates_config
-from .models import Report, StatusNotice
+from .models import BikeStands, Report, StatusNotice
 
 
 @override_settings(
@@ -116,6 +122,272 @@ class ApiTests(TestCase):
         self.assertFalse(report.user.notice_settings.first().send)
 
 
+class ReportListTest(TestCase):
+    fixtures = ['reports', 'plannings']
+
+    def setUp(self):
+        cache.clear()
+        # Content types are cached after the first lookup, which would
+        # distort the query counts
+        ContentType.objects.get_for_model(Report)
+
+    def test_like_counts(self):
+        """Test that like counts are included for nested reports as well."""
+        with CaptureQueriesContext(connection) as without_likes:
+            self.client.get('/api/reports')
+
+        report = Report.objects.get(pk=2)
+        for i in range(3):
+            user = get_user_model().objects.create_user(f'user{i}')
+            Like.objects.create(content_object=report, user=user)
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as with_likes:
+            response = self.client.get('/api/reports')
+        self.assertEqual(len(with_likes), len(without_likes))
+
+        reports = {r['id']: r for r in response.json()}
+        self.assertEqual(reports[2]['likes'], 3)
+        self.assertEqual(reports[1]['likes'], 0)
+        self.assertEqual(reports[4]['origin'][0]['likes'], 3)
+        self.assertEqual(reports[2]['plannings'][0]['likes'], 0)
+
+    def test_liked_by_user(self):
+        """Test that the like state of all reports is resolved at once."""
+        user = get_user_model().objects.create_user('foo', 'foo@example.org', 'bar')
+        header = self._get_authorization_header()
+        with CaptureQueriesContext(connection) as without_likes:
+            self.client.get('/api/reports', **header)
+
+        for report in Report.objects.filter(pk__in=[1, 2]):
+            Like.objects.create(content_object=report, user=user)
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as with_likes:
+            response = self.client.get('/api/reports', **header)
+        self.assertEqual(len(with_likes), len(without_likes))
+
+        reports = {r['id']: r for r in response.json()}
+        self.assertTrue(reports[1]['liked_by_user'])
+        self.assertTrue(reports[2]['liked_by_user'])
+        self.assertFalse(reports[4]['liked_by_user'])
+        self.assertTrue(reports[4]['origin'][0]['liked_by_user'])
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage'
+    )
+    def test_query_budget(self):
+        """Test that listing reports takes a fixed number of queries."""
+        with CaptureQueriesContext(connection) as few_reports:
+            response = self.client.get('/api/reports')
+        self.assertEqual(len(response.json()), 4)
+
+        reports = [
+            BikeStands.objects.create(
+                address=f'Adresse {i}',
+                geometry=Point(6.09, 50.77),
+                subject=Report.SUBJECT_BIKE_STANDS,
+                number=i % 10 + 1,
+            )
+            for i in range(496)
+        ]
+        content_type = ContentType.objects.get_for_model(Report)
+        Photo.objects.bulk_create(
+            Photo(content_type=content_type, object_id=r.id, src='photos/test.jpg')
+            for r in reports
+        )
+        Report.origin.through.objects.bulk_create(
+            Report.origin.through(from_report_id=planning.id, to_report_id=origin.id)
+            for origin, planning in zip(reports[::2], reports[1::2])
+        )
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as many_reports:
+            response = self.client.get('/api/reports')
+        self.assertEqual(len(response.json()), 500)
+        self.assertEqual(len(many_reports), len(few_reports))
+        # Reports, photos and origin reports and plannings with their photos
+        self.assertLessEqual(len(many_reports), 6)
+
+    def test_bbox(self):
+        response = self.client.get('/api/reports?bbox=6.09,50.776,6.095,50.78')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(r['id'] for r in response.json()), [1, 4])
+
+        response = self.client.get('/api/reports?bbox=6.09,50.775')
+        self.assertEqual(response.status_code, 400)
+
+    def test_modified_since(self):
+        response = self.client.get('/api/reports?modified_since=2020-10-06T11:40:00Z')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(r['id'] for r in response.json()), [1, 2])
+
+        response = self.client.get(
+            '/api/reports?modified_since=2020-10-06T12:40:00%2B01:00'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(r['id'] for r in response.json()), [1, 2])
+
+        # an unencoded `+` is decoded as a space
+        for value in ('yesterday', '2020-13-01T00:00:00', '2020-10-06T12:40:00+01:00'):
+            response = self.client.get(f'/api/reports?modified_since={value}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_pagination(self):
+        ids = []
+        url = '/api/reports?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 3)
+            ids.extend(r['id'] for r in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(ids, [1, 2, 3, 4])
+
+    def test_user_likes(self):
+        user = get_user_model().objects.create_user('foo', 'foo@example.org', 'bar')
+        Like.objects.create(content_object=Report.objects.get(pk=2), user=user)
+
+        response = self.client.get('/api/users/me/likes?ids=1,2,999')
+        self.assertEqual(response.status_code, 401)
+
+        header = self._get_authorization_header()
+        response = self.client.get('/api/users/me/likes?ids=2,1,999', **header)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            [
+                {'id': 1, 'likes': 0, 'user_has_liked': False},
+                {'id': 2, 'likes': 1, 'user_has_liked': True},
+            ],
+        )
+
+        for query in ('', '?ids=', '?ids=1,a'):
+            response = self.client.get('/api/users/me/likes' + query, **header)
+            self.assertEqual(response.status_code, 400)
+
+    def _get_authorization_header(self):
+        response = self.client.post(
+            '/api/jwt/create/',
+            json.dumps({'username': 'foo', 'password': 'bar'}),
+            content_type='application/json',
+        )
+        return {'HTTP_AUTHORIZATION': 'JWT ' + response.json()['access']}
+
+
+class ReportStatsTest(TestCase):
+    fixtures = ['reports', 'plannings']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_report_stats(self):
+        response = self.client.get('/api/reports/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                'reports': 2,
+                'reportsBikeStands': 9,
+                'plannings': 2,
+                'planningsBikeStands': 10,
+                'planningsByStatus': {'planning': 2, 'execution': 8},
+            },
+        )
+
+        # Only the version of the statistics is read
+        with self.assertNumQueries(1):
+            self.client.get('/api/reports/stats')
+
+        planning = BikeStands.objects.get(pk=4)
+        planning.status = Report.STATUS_DONE
+        planning.number = 5
+        planning.save()
+
+        response = self.client.get('/api/reports/stats')
+        self.assertEqual(response.json()['planningsBikeStands'], 13)
+        self.assertEqual(
+            response.json()['planningsByStatus'], {'execution': 8, 'done': 5}
+        )
+
+    def test_report_stats_import(self):
+        """Test that reports changed by another process, e.g. `importreports`,
+        are counted immediately."""
+        self.client.get('/api/reports/stats')
+        # The command process has its own cache
+        with patch('fixmyapp.caching.cache', new=LocMemCache('command', {})):
+            report = BikeStands.objects.get(pk=1)
+            report.status = Report.STATUS_REPORT_REJECTED
+            report.save()
+            BikeStands.objects.get(pk=3).delete()
+        response = self.client.get('/api/reports/stats')
+        self.assertEqual(response.json()['plannings'], 1)
+        self.assertEqual(response.json()['planningsByStatus'], {'planning': 2})
+
+
+class ReportClustersTest(TestCase):
+    fixtures = ['reports', 'plannings']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_clusters(self):
+        url = '/api/reports/clusters?zoom=5&bbox=5,50,7,51'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        cluster = response.json()[0]
+        self.assertEqual(cluster['count'], 4)
+        self.assertEqual(cluster['bike_stands'], 19)
+        self.assertEqual(
+            cluster['statuses'],
+            {'report_accepted': 2, 'planning': 1, 'execution': 1},
+        )
+        self.assertAlmostEqual(cluster['geometry']['coordinates'][1], 50.776, 2)
+
+        # Only the version of the clusters is read
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+        response = self.client.get('/api/reports/clusters?zoom=18&bbox=5,50,7,51')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(
+            '/api/reports/clusters?zoom=16&bbox=6.08,50.77,6.11,50.78'
+        )
+        self.assertEqual(len(response.json()), 4)
+
+    def test_clusters_invalidation(self):
+        url = '/api/reports/clusters?zoom=5&bbox=5,50,7,51'
+        self.client.get(url)
+        planning = BikeStands.objects.get(pk=4)
+        planning.number = 10
+        planning.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0]['bike_stands'], 27)
+
+    def test_clusters_import(self):
+        """Test that reports changed by another process, e.g. `importreports`,
+        are clustered immediately."""
+        url = '/api/reports/clusters?zoom=5&bbox=5,50,7,51'
+        self.client.get(url)
+        # The command process has its own cache
+        with patch('fixmyapp.caching.cache', new=LocMemCache('command', {})):
+            BikeStands.objects.create(
+                address='Neue Meldung',
+                geometry=Point(6.1, 50.77),
+                subject=Report.SUBJECT_BIKE_STANDS,
+                number=1,
+            )
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0]['count'], 5)
+
+    def test_invalid_parameters(self):
+        for query in ('', '?zoom=5', '?bbox=5,50,7,51', '?zoom=a&bbox=5,50,7,51'):
+            response = self.client.get('/api/reports/clusters' + query)
+            self.assertEqual(response.status_code, 400)
+
+
 @override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
 class LikeReportTest(LikeTest, TestCase):
     def setUp(self):
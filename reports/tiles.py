@@ -0,0 +1,19 @@
+from fixmyapp.tiles import Layer
+
+REPORTS = Layer(
+    'reports',
+    ('reports.Report', 'reports.BikeStands'),
+    'reports_report',
+    '''
+        t.id,
+        t.address,
+        t.created_date AS created,
+        t.description,
+        t.status,
+        t.status_reason,
+        b.number,
+        b.fee_acceptable IS TRUE AS fee_acceptable
+    ''',
+    'LEFT JOIN reports_bikestands b ON b.report_ptr_id = t.id',
+    where='t.published',
+)
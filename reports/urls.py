@@ -1,12 +1,15 @@
 from django.urls import path
 from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_headers
 from .models import Report
 from .views import (
     LikedByUserReportList,
     ReportDetail,
     ReportList,
     UnsubscribeView,
+    report_clusters,
     report_stats,
+    user_likes,
 )
 from fixmyapp.views import LikeView
 
@@ -16,7 +19,7 @@ app_name = 'reports'
 urlpatterns = [
     path(
         'reports',
-        cache_page(60 * 60 * 4)(ReportList.as_view()),
+        cache_page(60)(vary_on_headers('Authorization')(ReportList.as_view())),
         name='report-list'
     ),
     path(
@@ -29,6 +32,11 @@ urlpatterns = [
         LikedByUserReportList.as_view(),
         name='reports-liked-by-user'
     ),
+    path(
+        'users/me/likes',
+        user_likes,
+        name='likes-by-user'
+    ),
     path(
         'reports/<int:pk>/likes',
         LikeView.as_view(),
@@ -40,9 +48,14 @@ urlpatterns = [
         UnsubscribeView.as_view(), 
         name='unsubscribe-report-update'
     ),
+    path(
+        'reports/clusters',
+        report_clusters,
+        name='report-clusters'
+    ),
     path(
         'reports/stats',
-        cache_page(15)(report_stats)
+        report_stats
     )
 ]
 # fmt: on
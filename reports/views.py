@@ -1,20 +1,26 @@
 import uuid
+from datetime import timezone
 from django_auto_prefetching import AutoPrefetchViewSetMixin
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import check_password, make_password
 from django.core.exceptions import PermissionDenied
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
 from django.http import HttpResponseForbidden
 from django.views.generic import TemplateView
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.pagination import PageNumberPagination
-from collections import defaultdict
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
-from fixmyapp.models import NoticeSetting
-from .models import Like, Report, BikeStands
+from fixmyapp.geo import parse_bbox, parse_zoom
+from fixmyapp.models import NoticeSetting, liked_object_ids
+from . import clusters, stats
+from .models import Like, Report
 from .serializers import ReportSerializer
 
 
@@ -24,26 +30,118 @@ class DefaultPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
 
 
-class LikedByUserReportList(generics.ListAPIView):
+def with_related(queryset):
+    """Load the related objects serialized by `ReportSerializer`
+
+    Bike stands, photos and the nested origin reports and plannings are
+    loaded with a fixed number of queries, independent of the number of
+    reports.
+    """
+    nested = Report.objects.select_related('bikestands').prefetch_related('photo')
+    return queryset.select_related('bikestands').prefetch_related(
+        'photo',
+        Prefetch('origin', queryset=nested),
+        Prefetch('plannings', queryset=nested),
+    )
+
+
+class ReportPagination(CursorPagination):
+    """Keyset pagination by id
+
+    Only used if the `cursor` or `page_size` query parameter is given, so
+    that clients which expect a plain list of all reports keep working.
+    """
+
+    max_page_size = 1000
+    page_size = 100
+    page_size_query_param = 'page_size'
+    ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (
+            self.cursor_query_param not in params
+            and self.page_size_query_param not in params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+# Maximum number of reports whose like state can be requested at once
+MAX_LIKE_IDS = 1000
+
+# Maximum number of grid blocks covered by a clusters request
+MAX_CLUSTER_BLOCKS = 64
+
+
+class LikedReportIdsMixin:
+    """Provides the ids of the reports liked by the current user to the
+    serializer, so that `liked_by_user` does not need a query per report"""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['liked_report_ids'] = liked_object_ids(self.request.user, Report)
+        return context
+
+
+class LikedByUserReportList(LikedReportIdsMixin, generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     pagination_class = DefaultPagination
     serializer_class = ReportSerializer
 
     def get_queryset(self):
-        return Report.objects.filter(
-            likes__in=Like.objects.filter(user=self.request.user)
+        return with_related(
+            Report.objects.filter(likes__in=Like.objects.filter(user=self.request.user))
         ).order_by('id')
 
 
-class ReportList(AutoPrefetchViewSetMixin, generics.ListCreateAPIView):
+class ReportList(
+    LikedReportIdsMixin, AutoPrefetchViewSetMixin, generics.ListCreateAPIView
+):
+    """List published reports
+
+    Query parameters:
+
+    - `bbox`: only list reports within `min_lon,min_lat,max_lon,max_lat`
+    - `modified_since`: only list reports modified after this ISO 8601 date
+      and time, e.g. the latest `modified_date` of a previous response. Likes
+      and new plannings do not change the `modified_date` of a report.
+      Reports that have been unpublished or deleted since are not listed,
+      so clients need to fetch the full list from time to time to remove
+      them. The `+` of a UTC offset must be URL encoded as `%2B`, e.g.
+      `modified_since=2020-10-06T12:40:00%2B01:00`.
+    - `cursor`, `page_size`: paginate the list, ordered by id. The response
+      then contains the list as `results` and links to the `next` and
+      `previous` pages.
+    """
+
     permission_classes = (permissions.AllowAny,)
-    queryset = (
-        Report.objects.filter(published=1)
-        .select_related('bikestands')
-        .prefetch_related('origin', 'likes')
-    )
+    pagination_class = ReportPagination
+    queryset = with_related(Report.objects.filter(published=1)).order_by('id')
     serializer_class = ReportSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+
+        if 'bbox' in params:
+            queryset = queryset.filter(geometry__intersects=parse_bbox(params['bbox']))
+
+        if 'modified_since' in params:
+            try:
+                modified_since = parse_datetime(params['modified_since'])
+            except ValueError:
+                modified_since = None
+            if modified_since is None:
+                raise ValidationError(
+                    {'modified_since': _('Expected an ISO 8601 date and time.')}
+                )
+            if modified_since.tzinfo is None:
+                modified_since = modified_since.replace(tzinfo=timezone.utc)
+            queryset = queryset.filter(modified_date__gt=modified_since)
+
+        return queryset
+
     def perform_create(self, serializer):
         if self.request.user.is_authenticated:
             serializer.save(user=self.request.user)
@@ -51,9 +149,9 @@ class ReportList(AutoPrefetchViewSetMixin, generics.ListCreateAPIView):
             serializer.save()
 
 
-class ReportDetail(generics.RetrieveUpdateAPIView):
+class ReportDetail(LikedReportIdsMixin, generics.RetrieveUpdateAPIView):
     permission_classes = (permissions.AllowAny,)
-    queryset = Report.objects.filter(published=1)
+    queryset = with_related(Report.objects.filter(published=1))
     serializer_class = ReportSerializer
 
     def perform_update(self, serializer):
@@ -94,39 +192,58 @@ class UnsubscribeView(TemplateView):
 
 
 @api_view(['GET'])
-@permission_classes((permissions.AllowAny,))
-def report_stats(request):
-    reports = BikeStands.objects.filter(published=True)
-
-    REPORT_STATUSES = [
-        Report.STATUS_REPORT_NEW,
-        Report.STATUS_REPORT_VERIFICATION,
-        Report.STATUS_REPORT_ACCEPTED,
-        Report.STATUS_REPORT_REJECTED,
-        Report.STATUS_REPORT_INACTIVE,
-    ]
+@permission_classes((permissions.IsAuthenticated,))
+def user_likes(request):
+    """Returns the like state of the reports given as `ids` query parameter"""
+    try:
+        ids = [int(i) for i in request.query_params.get('ids', '').split(',')]
+    except ValueError:
+        ids = []
+    if not 0 < len(ids) <= MAX_LIKE_IDS:
+        raise ValidationError(
+            {
+                'ids': _('Expected up to {} comma-separated report ids.').format(
+                    MAX_LIKE_IDS
+                )
+            }
+        )
 
-    PLANNINGS_STATUSES = [
-        Report.STATUS_PLANNING,
-        Report.STATUS_TENDER,
-        Report.STATUS_EXECUTION,
-        Report.STATUS_DONE,
+    liked_ids = liked_object_ids(request.user, Report, ids)
+    reports = Report.objects.filter(published=1, id__in=ids).values_list(
+        'id', 'like_count'
+    )
+    result = [
+        {'id': id, 'likes': likes, 'user_has_liked': id in liked_ids}
+        for id, likes in reports.order_by('id')
     ]
+    return Response(result)
 
-    report_bike_stands = [r.number for r in reports if r.status in REPORT_STATUSES]
-
-    planning_bike_stands = []
-    plannings_by_status = defaultdict(int)
-    for r in reports:
-        if r.status in PLANNINGS_STATUSES:
-            planning_bike_stands.append(r.number)
-            plannings_by_status[r.status] += r.number
-
-    rv = {
-        'reports': len(report_bike_stands),
-        'reportsBikeStands': sum(report_bike_stands),
-        'plannings': len(planning_bike_stands),
-        'planningsBikeStands': sum(planning_bike_stands),
-        'planningsByStatus': plannings_by_status,
-    }
-    return Response(rv)
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def report_clusters(request):
+    """Returns clusters of the published reports in a map view
+
+    Query parameters:
+
+    - `zoom`: the zoom level of the map, which determines the cluster size
+    - `bbox`: the map view as `min_lon,min_lat,max_lon,max_lat`
+
+    Reports are clustered in grid cells of 64 pixels at the given zoom level.
+    Clusters are computed and cached per block of 16 x 16 cells, and the
+    clusters of all blocks covering the bounding box are returned, including
+    those just outside of it. See `reports.clusters`.
+    """
+    zoom = parse_zoom(request.query_params.get('zoom', ''))
+    bbox = parse_bbox(request.query_params.get('bbox', ''))
+    if len(clusters.blocks(bbox, zoom)) > MAX_CLUSTER_BLOCKS:
+        raise ValidationError(
+            {'bbox': _('The bounding box is too large for this zoom level.')}
+        )
+    return Response(clusters.get(bbox, zoom))
+
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def report_stats(request):
+    return Response(stats.get())